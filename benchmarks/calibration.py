@@ -0,0 +1,254 @@
+"""
+Calibration backends benchmark: sklearn IsotonicRegression (reference), NPIsotonicRegression and
+TFIsotonicRegression over data sizes, batch sizes and approximation levels.
+
+    python -m benchmarks.calibration --output calibration.json
+    python -m benchmarks.calibration --output new.json --baseline calibration.json
+
+Every case runs in a fresh process, so peak RSS and first-call costs are not shared between cases.
+With --baseline the run fails if a case got slower than --slowdown times or its deviation from
+sklearn grew by more than --deviation-tolerance.
+"""
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import resource
+import tempfile
+import tracemalloc
+import multiprocessing
+import numpy as np
+
+from typing import Dict, List, Optional
+
+BACKENDS = ('sklearn', 'numpy', 'tf')
+KEY = ('backend', 'n_rows', 'batch_size', 'approximation')
+
+
+def make_data(n_rows: int, seed: int = 0):
+    """Skewed scores of a slightly miscalibrated model and their labels"""
+    rng = np.random.default_rng(seed)
+    scores = rng.beta(2.0, 5.0, n_rows).astype(np.float32)
+    labels = (rng.random(n_rows) < scores ** 1.3).astype(np.float32)
+    return scores, labels
+
+
+def make_queries(n_rows: int, seed: int = 1) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    return np.concatenate([
+        rng.beta(2.0, 5.0, n_rows // 2), np.linspace(-0.05, 1.05, n_rows - n_rows // 2)
+    ]).astype(np.float32)
+
+
+def _model(backend: str, approximation: int):
+    if backend == 'sklearn':
+        from sklearn.isotonic import IsotonicRegression
+        return IsotonicRegression(y_min=0.0, y_max=1.0, out_of_bounds='clip')
+    if backend == 'numpy':
+        from np_isotonic import NPIsotonicRegression
+        return NPIsotonicRegression(y_min=0.0, y_max=1.0, approximation=approximation)
+    from tf_isotonic import TFIsotonicRegression
+    return TFIsotonicRegression(y_min=0.0, y_max=1.0, approximation=approximation)
+
+
+def _fit(model, backend: str, X: np.ndarray, y: np.ndarray, batch_size: Optional[int]) -> None:
+    if backend == 'sklearn':
+        # in float64: sklearn keeps float32 inputs in float32 and its PAVA then drifts by ~1e-2 at 1M rows
+        model.fit(X.astype(np.float64), y.astype(np.float64))
+    else:
+        model.fit(X, y, batch_size=batch_size)
+
+
+def _predict(model, backend: str, T: np.ndarray) -> np.ndarray:
+    if backend == 'tf':
+        return np.asarray(model(T))
+    return np.asarray(model.predict(T), dtype=np.float32)
+
+
+def _max_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on linux and bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 ** 2 if sys.platform == 'darwin' else 1024)
+
+
+def run_case(case: dict, predict_rows: int, repeats: int, seed: int, reference_dir: str) -> dict:
+    """One (backend, n_rows, batch_size, approximation) case; meant to run in its own process"""
+    backend, n_rows, batch_size, approximation = [case[k] for k in KEY]
+    X, y = make_data(n_rows, seed)
+    T = make_queries(predict_rows)
+
+    # first call includes imports, numba compilation and tf.function tracing
+    start = time.perf_counter()
+    _fit(_model(backend, approximation), backend, X[:1000], y[:1000], None)
+    first_call = time.perf_counter() - start
+
+    baseline_rss = _max_rss_mb()
+    fit_seconds = []
+    for i in range(repeats):
+        model = _model(backend, approximation)
+        if i == 0:
+            tracemalloc.start()
+        start = time.perf_counter()
+        _fit(model, backend, X, y, batch_size)
+        fit_seconds.append(time.perf_counter() - start)
+        if i == 0:
+            traced_peak = tracemalloc.get_traced_memory()[1] / 1024 ** 2
+            tracemalloc.stop()
+
+    predict_seconds = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        prediction = _predict(model, backend, T)
+        predict_seconds.append(time.perf_counter() - start)
+
+    reference_path = os.path.join(reference_dir, f'sklearn_{n_rows}.npy')
+    if backend == 'sklearn':
+        np.save(reference_path, prediction)
+    deviation = np.abs(prediction.astype(np.float64) - np.load(reference_path)).max() \
+        if os.path.exists(reference_path) else None
+
+    return dict(
+        case,
+        first_call_seconds=first_call,
+        fit_seconds=min(fit_seconds),
+        predict_rows_per_second=predict_rows / min(predict_seconds),
+        num_knots=len(model.X_thresholds_),
+        max_abs_deviation=None if deviation is None else float(deviation),
+        peak_rss_mb=_max_rss_mb(),
+        fit_rss_increase_mb=_max_rss_mb() - baseline_rss,
+        fit_traced_peak_mb=traced_peak
+    )
+
+
+def _run_case_in_child(queue, *args) -> None:
+    try:
+        queue.put(run_case(*args))
+    except Exception as e:
+        queue.put(dict(args[0], error=f'{type(e).__name__}: {e}'))
+
+
+def _cases(backends, sizes, batch_sizes, approximations) -> List[dict]:
+    cases = []
+    for n_rows in sizes:
+        # the sklearn reference of every size runs first, other cases compare against it
+        if 'sklearn' in backends:
+            cases.append(dict(backend='sklearn', n_rows=n_rows, batch_size=None, approximation=-1))
+        for backend in [b for b in backends if b != 'sklearn']:
+            for batch_size in batch_sizes:
+                for approximation in approximations:
+                    cases.append(dict(backend=backend, n_rows=n_rows, batch_size=batch_size, approximation=approximation))
+    return cases
+
+
+def _environment() -> dict:
+    versions = {}
+    for name in ('numpy', 'numba', 'sklearn', 'tensorflow'):
+        try:
+            versions[name] = __import__(name).__version__
+        except ImportError:
+            versions[name] = None
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        **versions
+    }
+
+
+def run(
+        backends=BACKENDS,
+        sizes=(100000, 1000000, 5000000),
+        batch_sizes=(None, 100000),
+        approximations=(-1, 3, 5),
+        predict_rows: int = 1000000,
+        repeats: int = 3,
+        seed: int = 0
+) -> dict:
+    context = multiprocessing.get_context('spawn')
+    results = []
+
+    with tempfile.TemporaryDirectory() as reference_dir:
+        for case in _cases(backends, sizes, batch_sizes, approximations):
+            queue = context.Queue()
+            process = context.Process(
+                target=_run_case_in_child, args=(queue, case, predict_rows, repeats, seed, reference_dir)
+            )
+            process.start()
+            process.join()
+            result = queue.get() if not queue.empty() else dict(case, error=f'exit code {process.exitcode}')
+            results.append(result)
+            print(json.dumps(result))
+
+    return {'environment': _environment(), 'results': results}
+
+
+def compare(report: dict, baseline: dict, slowdown: float = 1.5, deviation_tolerance: float = 1e-4) -> List[str]:
+    """Regressions of report against baseline, cases are matched on backend, n_rows, batch_size and approximation"""
+    previous: Dict[tuple, dict] = {tuple(r[k] for k in KEY): r for r in baseline['results'] if 'error' not in r}
+    regressions = []
+
+    for result in report['results']:
+        key = tuple(result[k] for k in KEY)
+        if 'error' in result:
+            if key in previous:
+                regressions.append(f'{key}: failed with {result["error"]}')
+            continue
+        if key not in previous:
+            continue
+        old = previous[key]
+        if result['fit_seconds'] > slowdown * old['fit_seconds']:
+            regressions.append(f'{key}: fit {old["fit_seconds"]:.3f}s -> {result["fit_seconds"]:.3f}s')
+        if result['predict_rows_per_second'] * slowdown < old['predict_rows_per_second']:
+            regressions.append(
+                f'{key}: predict {old["predict_rows_per_second"]:.0f} -> {result["predict_rows_per_second"]:.0f} rows/s'
+            )
+        if result['max_abs_deviation'] is not None and old['max_abs_deviation'] is not None and \
+                result['max_abs_deviation'] > old['max_abs_deviation'] + deviation_tolerance:
+            regressions.append(
+                f'{key}: deviation {old["max_abs_deviation"]:.2e} -> {result["max_abs_deviation"]:.2e}'
+            )
+    return regressions
+
+
+def _batch_size(value: str) -> Optional[int]:
+    return None if value.lower() in ('none', '0') else int(value)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark of isotonic calibration backends')
+    parser.add_argument('--backends', nargs='+', default=list(BACKENDS), choices=BACKENDS)
+    parser.add_argument('--sizes', nargs='+', type=int, default=[100000, 1000000, 5000000])
+    parser.add_argument('--batch-sizes', nargs='+', type=_batch_size, default=[None, 100000],
+                        help='none for a single-batch fit')
+    parser.add_argument('--approximations', nargs='+', type=int, default=[-1, 3, 5])
+    parser.add_argument('--predict-rows', type=int, default=1000000)
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='calibration_benchmark.json')
+    parser.add_argument('--baseline', default=None, help='previous report to check for regressions')
+    parser.add_argument('--slowdown', type=float, default=1.5)
+    parser.add_argument('--deviation-tolerance', type=float, default=1e-4)
+    args = parser.parse_args()
+
+    report = run(
+        backends=args.backends,
+        sizes=args.sizes,
+        batch_sizes=args.batch_sizes,
+        approximations=args.approximations,
+        predict_rows=args.predict_rows,
+        repeats=args.repeats,
+        seed=args.seed
+    )
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f'Report written to {args.output}')
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(report, json.load(f), args.slowdown, args.deviation_tolerance)
+        for regression in regressions:
+            print(f'REGRESSION {regression}')
+        sys.exit(1 if regressions else 0)
@@ -0,0 +1,170 @@
+"""
+Import time benchmark: every case runs in a fresh interpreter, like a CLI job or a spawned worker.
+
+    python -m benchmarks.import_time
+    python -m benchmarks.import_time --output import_time.json --budget-scale 2
+
+A case fails if its median time is over budget (times --budget-scale, for slower machines) or if it
+loads one of its forbidden modules, i.e. a heavy dependency that must only be imported on use.
+First-call cases include numba dispatch, so a kernel recompiling instead of loading from cache shows up.
+With --top the heaviest imports of every case are printed from python -X importtime.
+"""
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+
+from typing import List
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY = ('tensorflow', 'tensorflow_decision_forests', 'sklearn', 'optuna')
+
+CASES = [
+    dict(name='intent_model.functions', code='import intent_model.functions', budget=1.0, forbidden=HEAVY),
+    dict(
+        name='intent_model.preprocessing.preprocess_functions',
+        code='import intent_model.preprocessing.preprocess_functions',
+        budget=1.0,
+        forbidden=HEAVY + ('geopy',)
+    ),
+    dict(
+        name='intent_model.preprocessing.preprocess',
+        code='import intent_model.preprocessing.preprocess',
+        budget=1.5,
+        forbidden=HEAVY + ('geopy', 'intent_model.drift')
+    ),
+    dict(name='intent_model.evaluation', code='import intent_model.evaluation', budget=1.0, forbidden=HEAVY),
+    dict(name='intent_model.score_histogram', code='import intent_model.score_histogram', budget=1.0, forbidden=HEAVY),
+    dict(
+        name='intent_model.calibration_metrics', code='import intent_model.calibration_metrics', budget=1.0,
+        forbidden=HEAVY
+    ),
+    dict(
+        name='intent_model.serving.artifact', code='import intent_model.serving.artifact', budget=1.5,
+        forbidden=HEAVY
+    ),
+    dict(
+        name='intent_model.serving.batch_scoring',
+        code='import intent_model.serving.batch_scoring',
+        budget=2.0,
+        forbidden=HEAVY + ('geopy', 'intent_model.drift')
+    ),
+    dict(name='np_isotonic', code='import np_isotonic', budget=1.0, forbidden=HEAVY),
+    dict(
+        name='fast_normalize first call',
+        code='import numpy as np\n'
+             'from intent_model.preprocessing.preprocess_functions import fast_normalize\n'
+             'fast_normalize(np.ones((1, 3)))',
+        budget=1.5,
+        forbidden=HEAVY + ('geopy',)
+    ),
+    dict(
+        name='artifact first score',
+        code='import numpy as np\n'
+             'from intent_model.serving.forest import CompiledForest\n'
+             'from intent_model.serving.artifact import ScoringArtifact\n'
+             'arrays = dict(roots=np.zeros(1), kind=np.zeros(1), feature=np.zeros(1), threshold=np.zeros(1), '
+             'cat_mask=np.zeros(1), missing_pos=np.zeros(1), pos_child=np.zeros(1), neg_child=np.zeros(1), '
+             'value=np.zeros(1))\n'
+             'forest = CompiledForest(arrays, ["x"], {})\n'
+             'ScoringArtifact(forest, np.array([0.0, 1.0]), np.array([0.0, 1.0])).score(np.zeros((1, 1)))',
+        budget=2.0,
+        forbidden=HEAVY
+    )
+]
+
+_CHILD = '''
+import sys, time, json
+start = time.perf_counter()
+exec(compile({code!r}, '<case>', 'exec'))
+seconds = time.perf_counter() - start
+print(json.dumps({{'seconds': seconds, 'modules': sorted(sys.modules)}}))
+'''
+
+
+def _env() -> dict:
+    path = os.environ.get('PYTHONPATH')
+    return dict(os.environ, PYTHONPATH=ROOT if not path else ROOT + os.pathsep + path)
+
+
+def run_case(case: dict, repeats: int) -> dict:
+    """Median of repeats fresh interpreters; the first run also warms numba caches, as a deployed job would be"""
+    seconds, modules = [], []
+    for _ in range(repeats + 1):
+        out = subprocess.run(
+            [sys.executable, '-c', _CHILD.format(code=case['code'])],
+            cwd=ROOT, env=_env(), capture_output=True, text=True
+        )
+        if out.returncode != 0:
+            return dict(name=case['name'], error=out.stderr.strip().splitlines()[-1])
+        result = json.loads(out.stdout.strip().splitlines()[-1])
+        seconds.append(result['seconds'])
+        modules = result['modules']
+
+    loaded = [x for x in case['forbidden'] if x in modules]
+    return dict(
+        name=case['name'],
+        seconds=statistics.median(seconds[1:]),
+        cold_seconds=seconds[0],
+        budget=case['budget'],
+        forbidden_loaded=loaded,
+        num_modules=len(modules)
+    )
+
+
+def top_imports(case: dict, n: int = 10) -> List[str]:
+    """Heaviest imports of a case by cumulative time, from python -X importtime"""
+    out = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', case['code']], cwd=ROOT, env=_env(), capture_output=True, text=True
+    )
+    rows = []
+    for line in out.stderr.splitlines():
+        if line.startswith('import time:') and '|' in line and 'cumulative' not in line:
+            _, cumulative, name = line[len('import time:'):].split('|')
+            rows.append((int(cumulative), name.rstrip()))
+    return [f'{us / 1e6:8.3f}s {name}' for us, name in sorted(rows, reverse=True)[:n]]
+
+
+def check(results: List[dict], budget_scale: float = 1.0) -> List[str]:
+    failures = []
+    for result in results:
+        if 'error' in result:
+            failures.append(f'{result["name"]}: {result["error"]}')
+            continue
+        budget = result['budget'] * budget_scale
+        if result['seconds'] > budget:
+            failures.append(f'{result["name"]}: {result["seconds"]:.3f}s over budget {budget:.2f}s')
+        if result['forbidden_loaded']:
+            failures.append(f'{result["name"]}: loads {", ".join(result["forbidden_loaded"])}')
+    return failures
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Import time benchmark of intent_model')
+    parser.add_argument('--cases', nargs='+', default=None, help='case names, all by default')
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--budget-scale', type=float, default=1.0)
+    parser.add_argument('--top', type=int, default=0, help='print the N heaviest imports of every case')
+    parser.add_argument('--output', default=None)
+    args = parser.parse_args()
+
+    cases = [x for x in CASES if args.cases is None or x['name'] in args.cases]
+    results = []
+    for case in cases:
+        result = run_case(case, args.repeats)
+        results.append(result)
+        print(json.dumps(result))
+        if args.top:
+            print('\n'.join(top_imports(case, args.top)))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'budget_scale': args.budget_scale, 'results': results}, f, indent=2)
+
+    failures = check(results, args.budget_scale)
+    if failures:
+        print('Import time regressions:\n' + '\n'.join(failures))
+        sys.exit(1)
+    print(f'{len(results)} cases within budget')
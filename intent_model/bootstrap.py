@@ -0,0 +1,212 @@
+import numpy as np
+import pandas as pd
+
+from typing import Iterable, Tuple
+from numba import jit, prange
+
+RELEVANCE_METRICS = ['sa_coverage', 'rh_coverage', 'relevance (rh total)', 'relevance (freq only)', '% of freq detected']
+
+
+@jit(nopython=True, nogil=True, cache=True)
+def _mix(z: np.uint64) -> np.uint64:
+    # splitmix64 finalizer
+    z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return z ^ (z >> np.uint64(31))
+
+
+@jit(nopython=True, nogil=True, cache=True)
+def _poisson_weight(seed: int, replicate: int, cluster: int) -> float:
+    """Poisson(1) draw that only depends on (seed, replicate, cluster), so replicates are reproducible
+    in parallel and identical for two models scored on the same data"""
+    z = _mix(np.uint64(seed) * np.uint64(0x9E3779B97F4A7C15) + np.uint64(replicate))
+    z = _mix(z + np.uint64(cluster) * np.uint64(0x9E3779B97F4A7C15))
+    u = np.float64(z >> np.uint64(11)) * (1.0 / 9007199254740992.0)
+
+    k, p = 0, np.exp(-1.0)
+    cdf = p
+    while u > cdf and k < 30:
+        k += 1
+        p /= k
+        cdf += p
+    return np.float64(k)
+
+
+@jit(nopython=True, parallel=True, nogil=True, cache=True)
+def _replicate_counts(
+        scores: np.ndarray,
+        clusters: np.ndarray,
+        y: np.ndarray,
+        rh: np.ndarray,
+        freq: np.ndarray,
+        relevant: np.ndarray,
+        n_clusters: int,
+        thresholds: np.ndarray,
+        targets: np.ndarray,
+        n_replicates: int,
+        seed: int
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Rows must be sorted by descending score, thresholds descending.
+    Replicate 0 has unit weights (point estimate), replicates 1..n_replicates cluster Poisson weights.
+
+    Returns per replicate:
+        above: (T, 3) weighted sessions / rh / is_freq sessions with score > threshold
+        totals: (4,) weighted sessions / rh / relevant (rh and is_freq) / positives
+        optimal: (K, 2) threshold and tp weight of get_optimal_threshold (score >= threshold): the max tp
+            among thresholds with precision >= target, at the lowest threshold with that tp
+    """
+    n, T, K = scores.shape[0], thresholds.shape[0], targets.shape[0]
+    above = np.zeros((n_replicates + 1, T, 3))
+    totals = np.zeros((n_replicates + 1, 4))
+    optimal = np.full((n_replicates + 1, K, 2), np.nan)
+
+    for b in prange(n_replicates + 1):
+        w = np.ones(n_clusters)
+        if b > 0:
+            for c in range(n_clusters):
+                w[c] = _poisson_weight(seed, b, c)
+
+        sessions, rh_sum, freq_sum, relevant_sum, tp = 0.0, 0.0, 0.0, 0.0, 0.0
+        j = 0
+        for i in range(n):
+            while j < T and scores[i] <= thresholds[j]:
+                above[b, j, 0], above[b, j, 1], above[b, j, 2] = sessions, rh_sum, freq_sum
+                j += 1
+
+            wi = w[clusters[i]]
+            sessions += wi
+            rh_sum += wi * rh[i]
+            freq_sum += wi * freq[i]
+            relevant_sum += wi * relevant[i]
+            tp += wi * y[i]
+
+            if (i == n - 1 or scores[i + 1] != scores[i]) and sessions > 0:
+                precision = tp / sessions
+                for k in range(K):
+                    # like get_optimal_threshold, lower thresholds adding no positives (same recall)
+                    # are taken even below the target precision
+                    if precision >= targets[k] or optimal[b, k, 1] == tp:
+                        optimal[b, k, 0], optimal[b, k, 1] = scores[i], tp
+
+        while j < T:
+            above[b, j, 0], above[b, j, 1], above[b, j, 2] = sessions, rh_sum, freq_sum
+            j += 1
+        totals[b, 0], totals[b, 1], totals[b, 2], totals[b, 3] = sessions, rh_sum, relevant_sum, tp
+
+    return above, totals, optimal
+
+
+def _replicate_metrics(
+        data: pd.DataFrame,
+        scores: np.ndarray,
+        thresholds: Iterable[float],
+        target_precisions: Iterable[float],
+        n_replicates: int,
+        cluster_col: str,
+        label_col: str,
+        seed: int
+) -> Tuple[pd.DataFrame, np.ndarray]:
+    scores = np.asarray(scores).flatten()
+    order = np.argsort(-scores, kind='stable')
+    clusters, uniques = pd.factorize(data[cluster_col])
+    rh = data['rh'].values == 1
+    freq = data['is_freq'].values == 1
+
+    thresholds = np.asarray(list(thresholds), dtype=np.float64)
+    targets = np.asarray(list(target_precisions), dtype=np.float64)
+    desc = np.argsort(-thresholds, kind='stable')
+
+    above, totals, optimal = _replicate_counts(
+        scores[order].astype(np.float64),
+        clusters[order].astype(np.int64),
+        (data[label_col].values == 1)[order].astype(np.float64),
+        rh[order].astype(np.float64),
+        freq[order].astype(np.float64),
+        (rh & freq)[order].astype(np.float64),
+        len(uniques),
+        thresholds[desc],
+        targets,
+        n_replicates,
+        seed
+    )
+    above[:, desc] = above.copy()
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        sessions, rh_above, relevant_above = above[..., 0], above[..., 1], above[..., 2]
+        metrics = np.stack([
+            sessions / totals[:, [0]],
+            rh_above / totals[:, [1]],
+            rh_above / sessions,
+            relevant_above / sessions,
+            relevant_above / totals[:, [2]]
+        ], axis=-1)  # (B + 1, T, 5)
+        optimal_recall = optimal[..., 1] / totals[:, [3]]
+
+    index, values = [], []
+    for i, t in enumerate(thresholds):
+        for m, metric in enumerate(RELEVANCE_METRICS):
+            index.append((metric, t))
+            values.append(metrics[:, i, m])
+    for k, target in enumerate(targets):
+        index.append(('optimal_threshold', target))
+        values.append(optimal[:, k, 0])
+        index.append(('expected_recall', target))
+        values.append(np.nan_to_num(optimal_recall[:, k], nan=0.0))
+
+    return pd.DataFrame(index, columns=['metric', 'at']), np.stack(values)
+
+
+def _summarize(index: pd.DataFrame, values: np.ndarray, alpha: float) -> pd.DataFrame:
+    replicates = values[:, 1:]
+    return index.assign(
+        estimate=values[:, 0],
+        std=np.nanstd(replicates, axis=1),
+        lower=np.nanquantile(replicates, alpha / 2, axis=1),
+        upper=np.nanquantile(replicates, 1 - alpha / 2, axis=1)
+    )
+
+
+def bootstrap_relevance(
+        data: pd.DataFrame,
+        scores: np.ndarray,
+        thresholds: Iterable[float] = (0.4, 0.5, 0.6, 0.7, 0.8, 0.9),
+        target_precisions: Iterable[float] = (0.9,),
+        n_replicates: int = 1000,
+        alpha: float = 0.05,
+        cluster_col: str = 'customer_id',
+        label_col: str = 'target',
+        seed: int = 42
+) -> pd.DataFrame:
+    """
+    Percentile bootstrap intervals for the get_relevance metrics at every threshold and for
+    get_optimal_threshold (threshold and expected recall) at every target precision. If no threshold
+    reaches a target precision, its threshold is NaN and its recall 0, where get_optimal_threshold fails.
+
+    Sessions of one customer are resampled together: each replicate gives every customer a
+    Poisson(1) weight. Scores are sorted once, replicates run in parallel in one pass each.
+    at holds the threshold or the target precision of the row.
+    """
+    index, values = _replicate_metrics(
+        data, scores, thresholds, target_precisions, n_replicates, cluster_col, label_col, seed
+    )
+    return _summarize(index, values, alpha)
+
+
+def bootstrap_difference(
+        data: pd.DataFrame,
+        scores_a: np.ndarray,
+        scores_b: np.ndarray,
+        thresholds: Iterable[float] = (0.4, 0.5, 0.6, 0.7, 0.8, 0.9),
+        target_precisions: Iterable[float] = (0.9,),
+        n_replicates: int = 1000,
+        alpha: float = 0.05,
+        cluster_col: str = 'customer_id',
+        label_col: str = 'target',
+        seed: int = 42
+) -> pd.DataFrame:
+    """Intervals for metric(b) - metric(a), using the same customer weights for both models in every replicate"""
+    args = (thresholds, target_precisions, n_replicates, cluster_col, label_col, seed)
+    index, values_a = _replicate_metrics(data, scores_a, *args)
+    _, values_b = _replicate_metrics(data, scores_b, *args)
+    return _summarize(index, values_b - values_a, alpha)
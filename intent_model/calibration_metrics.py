@@ -0,0 +1,158 @@
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+
+from typing import Iterable, Optional, Union
+
+STRATEGIES = ('uniform', 'quantile')
+
+
+class CalibrationAccumulator(object):
+    """
+    Streaming calibration metrics: ECE, MCE, Brier score and reliability curves.
+
+    Every update adds the weight, score sum and label sum of each of resolution fine bins
+    (right-closed, (i / resolution, (i + 1) / resolution], scores <= 0 go to the first bin) in one
+    bincount pass, so chunks of any size can be added and accumulators of different chunks or
+    processes merged by addition. Reliability bins are built from the fine bins afterwards:
+        - uniform: n_bins equal-width bins, exactly (lower, upper] when n_bins divides resolution
+        - quantile: n_bins bins of about equal weight, edges snapped to the fine grid
+    so any number of bins and both strategies come from the same pass. The Brier score is exact.
+    """
+    def __init__(self, resolution: int = 100000):
+        self.resolution = resolution
+        self.weight = np.zeros(resolution, dtype=np.float64)
+        self.score_sum = np.zeros(resolution, dtype=np.float64)
+        self.label_sum = np.zeros(resolution, dtype=np.float64)
+        self.squared_error = 0.0
+
+    def update(
+            self,
+            y_true: np.ndarray,
+            y_score: np.ndarray,
+            sample_weight: Optional[np.ndarray] = None
+    ) -> 'CalibrationAccumulator':
+        y = (np.asarray(y_true).flatten() == 1).astype(np.float64)
+        p = np.asarray(y_score, dtype=np.float64).flatten()
+        w = np.ones(len(p)) if sample_weight is None else np.asarray(sample_weight, dtype=np.float64).flatten()
+
+        idx = np.clip(np.ceil(p * self.resolution).astype(np.int64) - 1, 0, self.resolution - 1)
+        self.weight += np.bincount(idx, weights=w, minlength=self.resolution)
+        self.score_sum += np.bincount(idx, weights=w * p, minlength=self.resolution)
+        self.label_sum += np.bincount(idx, weights=w * y, minlength=self.resolution)
+        self.squared_error += float(np.sum(w * (p - y) ** 2))
+        return self
+
+    def merge(self, other: 'CalibrationAccumulator') -> 'CalibrationAccumulator':
+        assert self.resolution == other.resolution, 'Accumulators have different resolution'
+        self.weight += other.weight
+        self.score_sum += other.score_sum
+        self.label_sum += other.label_sum
+        self.squared_error += other.squared_error
+        return self
+
+    def __add__(self, other: 'CalibrationAccumulator') -> 'CalibrationAccumulator':
+        return self.copy().merge(other)
+
+    def copy(self) -> 'CalibrationAccumulator':
+        acc = CalibrationAccumulator(self.resolution)
+        acc.weight, acc.score_sum, acc.label_sum = self.weight.copy(), self.score_sum.copy(), self.label_sum.copy()
+        acc.squared_error = self.squared_error
+        return acc
+
+    @classmethod
+    def from_parquet(
+            cls,
+            paths: Union[str, Iterable[str]],
+            label_col: str = 'target',
+            score_col: str = 'calibrated_score',
+            weight_col: Optional[str] = None,
+            batch_size: int = 1000000,
+            **kwargs
+    ) -> 'CalibrationAccumulator':
+        """Streams parquet files (e.g. batch scoring output joined with labels), reading only the needed columns"""
+        acc = cls(**kwargs)
+        columns = [label_col, score_col] + ([weight_col] if weight_col else [])
+        for path in [paths] if isinstance(paths, str) else paths:
+            for batch in pq.ParquetFile(path).iter_batches(batch_size=batch_size, columns=columns):
+                weight = batch.column(weight_col).to_numpy() if weight_col else None
+                acc.update(batch.column(label_col).to_numpy(), batch.column(score_col).to_numpy(), weight)
+        return acc
+
+    @property
+    def total_weight(self) -> float:
+        return float(self.weight.sum())
+
+    def _bins(self, n_bins: int, strategy: str) -> np.ndarray:
+        """Reliability bin of every fine bin"""
+        assert strategy in STRATEGIES, f'strategy must be one of {STRATEGIES}'
+        if strategy == 'uniform':
+            return np.arange(self.resolution) * n_bins // self.resolution
+        # fine bins are assigned by the middle of their weight, so bins hold ~total / n_bins each
+        middle = np.cumsum(self.weight) - self.weight / 2
+        return np.minimum((middle * n_bins / self.total_weight).astype(np.int64), n_bins - 1)
+
+    def reliability_curve(self, n_bins: int = 15, strategy: str = 'uniform') -> pd.DataFrame:
+        """Non-empty reliability bins with score range, weight, mean score, fraction of positives and their gap"""
+        bins = self._bins(n_bins, strategy)
+        fine_edges = np.arange(self.resolution + 1) / self.resolution
+        occupied = self.weight > 0
+
+        def total(values: np.ndarray) -> np.ndarray:
+            return np.bincount(bins, weights=values, minlength=n_bins)
+
+        weight = total(self.weight)
+        lower = np.full(n_bins, np.inf)
+        upper = np.full(n_bins, -np.inf)
+        np.minimum.at(lower, bins[occupied], fine_edges[:-1][occupied])
+        np.maximum.at(upper, bins[occupied], fine_edges[1:][occupied])
+
+        keep = weight > 0
+        with np.errstate(divide='ignore', invalid='ignore'):
+            mean_score = total(self.score_sum) / weight
+            fraction_of_positives = total(self.label_sum) / weight
+
+        return pd.DataFrame({
+            'bin': np.arange(n_bins)[keep],
+            'lower': lower[keep],
+            'upper': upper[keep],
+            'weight': weight[keep],
+            'mean_score': mean_score[keep],
+            'fraction_of_positives': fraction_of_positives[keep],
+            'gap': np.abs(mean_score - fraction_of_positives)[keep]
+        })
+
+    def expected_calibration_error(self, n_bins: int = 15, strategy: str = 'uniform') -> float:
+        curve = self.reliability_curve(n_bins, strategy)
+        return float(np.sum(curve['weight'] * curve['gap']) / curve['weight'].sum())
+
+    def maximum_calibration_error(self, n_bins: int = 15, strategy: str = 'uniform') -> float:
+        return float(self.reliability_curve(n_bins, strategy)['gap'].max())
+
+    def brier_score(self) -> float:
+        return self.squared_error / self.total_weight
+
+    def summary(self, n_bins: int = 15, strategy: str = 'uniform') -> dict:
+        curve = self.reliability_curve(n_bins, strategy)
+        return {
+            'weight': self.total_weight,
+            'ece': float(np.sum(curve['weight'] * curve['gap']) / curve['weight'].sum()),
+            'mce': float(curve['gap'].max()),
+            'brier': self.brier_score(),
+            'mean_score': float(self.score_sum.sum() / self.total_weight),
+            'fraction_of_positives': float(self.label_sum.sum() / self.total_weight)
+        }
+
+
+def expected_calibration_error(
+        y_true: np.ndarray,
+        y_score: np.ndarray,
+        n_bins: int = 15,
+        strategy: str = 'uniform',
+        sample_weight: Optional[np.ndarray] = None
+) -> float:
+    """
+    sum over bins of |mean score - fraction of positives| * bin weight / total weight, bins (lower, upper].
+    Unlike the notebook helper, compares the score with the label, not the accuracy of score > 0.5
+    """
+    return CalibrationAccumulator().update(y_true, y_score, sample_weight).expected_calibration_error(n_bins, strategy)
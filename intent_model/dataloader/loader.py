@@ -1,15 +1,49 @@
 import os
+import re
+import json
+import time
+import hashlib
 import polars as pl
 import pandas as pd
-from typing import Optional, Callable, Dict
+from typing import Optional, Callable, Dict, List
 from tqdm import tqdm
 from pyhive import presto
 
 
 try:
     from .sql.queries import get_intents, get_rh_features, get_food_features
+    from ..profiling import StageProfiler, NULL_PROFILER
 except ImportError:
     from sql.queries import get_intents, get_rh_features, get_food_features
+    from profiling import StageProfiler, NULL_PROFILER
+
+QUERY_STATS_FILE = 'query_stats.jsonl'
+MANIFEST_FILE = 'manifest.json'
+
+# Presto query stats (camelCase in the REST API) kept per query, in ms / rows / bytes
+PRESTO_STATS = {
+    'wallTimeMillis': 'wall_ms',
+    'elapsedTimeMillis': 'elapsed_ms',
+    'queuedTimeMillis': 'queued_ms',
+    'cpuTimeMillis': 'cpu_ms',
+    'processedRows': 'processed_rows',
+    'processedBytes': 'processed_bytes',
+    'peakMemoryBytes': 'peak_memory_bytes',
+    'spilledBytes': 'spilled_bytes',
+    'totalSplits': 'splits'
+}
+
+
+def query_fingerprint(query: str, date: Optional[str] = None) -> str:
+    """Hash of the query text with the date literal and whitespace normalised, same for every date of a builder"""
+    if date is not None:
+        query = query.replace(str(date), '?')
+    return hashlib.sha1(re.sub(r'\s+', ' ', query).strip().encode()).hexdigest()[:16]
+
+
+def read_query_stats(path: str) -> pd.DataFrame:
+    """Query stats of all runs written to a loader path"""
+    return pd.read_json(os.path.join(path, QUERY_STATS_FILE), lines=True, convert_dates=False)
 
 
 def clean_sessions(sessions: pl.DataFrame) -> pl.DataFrame:
@@ -52,7 +86,8 @@ class PrestoLoader(object):
             service: Optional[dict] = None,
             history_horizon: int = 60,
             percentile: float = 0.8,
-            path: str = 'data'
+            path: str = 'data',
+            profiler: StageProfiler = NULL_PROFILER
     ):
         if service is None:
             service = TargetService().RH
@@ -64,6 +99,9 @@ class PrestoLoader(object):
         self.percentile = percentile
         self.conn = None
         self.path = path
+        self.profiler = profiler
+        self.query_stats = []
+        self.run_id = None
         self.features_path = os.path.join(self.path, 'features')
         self.sessions_path = os.path.join(self.path, 'sessions')
 
@@ -83,31 +121,122 @@ class PrestoLoader(object):
             port=8080
         )
 
-    def _load_chunk(self, query: str) -> pl.DataFrame:
+    def _execute(self, query: str, name: str, date: Optional[str], builder: Optional[str]) -> pl.DataFrame:
+        cursor = self.conn.cursor()
+        start = time.perf_counter()
+        # polling until the query finishes buffers all result pages, so waiting and fetching are timed apart;
+        # the last status has the final query stats
+        status = {}
+        with self.profiler.stage(f'{name}_query', day=date):
+            cursor.execute(query)
+            response = cursor.poll()
+            while response is not None:
+                status = response
+                response = cursor.poll()
+        query_seconds = time.perf_counter() - start
+
+        with self.profiler.stage(f'{name}_fetch', day=date) as s:
+            rows = cursor.fetchall()
+            columns = [x[0] for x in cursor.description or []]
+            frame = pl.DataFrame(rows, schema=columns, orient='row')
+            s.rows_out = len(frame)
+
+        stats = status.get('stats', {})
+        self._record_query({
+            'run_id': self.run_id,
+            'name': name,
+            'builder': builder,
+            'date': date,
+            'fingerprint': query_fingerprint(query, date),
+            'history_horizon': self.history_horizon,
+            'percentile': self.percentile,
+            'query_id': status.get('id'),
+            'state': stats.get('state'),
+            **{v: stats.get(k) for k, v in PRESTO_STATS.items()},
+            'client_query_seconds': round(query_seconds, 3),
+            'client_total_seconds': round(time.perf_counter() - start, 3),
+            'rows': len(frame)
+        })
+        return frame
+
+    def _record_query(self, record: dict) -> None:
+        self.query_stats.append(record)
+        with open(os.path.join(self.path, QUERY_STATS_FILE), 'a') as f:
+            f.write(json.dumps(record) + '\n')
+
+    def _load_chunk(
+            self,
+            query: str,
+            name: str = 'query',
+            date: Optional[str] = None,
+            builder: Optional[str] = None
+    ) -> pl.DataFrame:
         try:
-            return pl.read_database(query=query, connection=self.conn)
+            return self._execute(query, name, date, builder)
         except presto.DatabaseError:
             self._initiate()
-            return pl.read_database(query=query, connection=self.conn)
+            return self._execute(query, name, date, builder)
+
+    def _write_manifest(self, dates: List[str], include_sessions: bool, include_features: bool) -> None:
+        """Parameters, files and per-query cost totals of the last load, next to QUERY_STATS_FILE"""
+        stats = pd.DataFrame(self.query_stats)
+        queries = {}
+        if not stats.empty:
+            totals = ['wall_ms', 'cpu_ms', 'queued_ms', 'processed_rows', 'processed_bytes', 'client_total_seconds']
+            for name, group in stats.groupby('name'):
+                queries[name] = {
+                    'builder': group['builder'].iloc[0],
+                    'fingerprints': sorted(group['fingerprint'].unique().tolist()),
+                    'queries': len(group),
+                    **{k: float(group[k].sum()) for k in totals if group[k].notna().any()},
+                    'max_peak_memory_bytes': float(group['peak_memory_bytes'].max())
+                    if group['peak_memory_bytes'].notna().any() else None
+                }
+
+        manifest = {
+            'run_id': self.run_id,
+            'up_to_date': self.up_to_date,
+            'days_back': self.days_back,
+            'history_horizon': self.history_horizon,
+            'percentile': self.percentile,
+            'builders': {k: getattr(v, '__name__', str(v)) for k, v in self.service.items()},
+            'dates': list(dates),
+            'features': [f'features/{x}.pq' for x in dates] if include_features else [],
+            'sessions': [f'sessions/{x}.pq' for x in dates] if include_sessions else [],
+            'query_stats': QUERY_STATS_FILE,
+            'queries': queries
+        }
+        with open(os.path.join(self.path, MANIFEST_FILE), 'w') as f:
+            json.dump(manifest, f, indent=2)
 
     def terminate(self) -> None:
         self.conn.close()
 
     def load(self, include_sessions: bool = True, include_features: bool = True) -> None:
         dates = pd.date_range(end=self.up_to_date, periods=self.days_back, freq='D').astype(str).values
+        self.run_id = pd.Timestamp.now().isoformat(timespec='seconds')
+        self.query_stats = []
         self._initiate()
 
         for date in tqdm(dates):
-            if include_features:
-                get_user_features = self.service['features']
-                features = self._load_chunk(get_user_features(date, self.history_horizon, self.percentile))
-                features.write_parquet(os.path.join(self.features_path, f'{date}.pq'))
-
-            if include_sessions:
-                get_intents = self.service['intents']
-                sessions = self._load_chunk(get_intents(date, self.history_horizon, self.percentile))
-                sessions = clean_sessions(sessions)
-                sessions.write_parquet(os.path.join(self.sessions_path, f'{date}.pq'))
+            with self.profiler.stage('day', day=date):
+                if include_features:
+                    get_user_features = self.service['features']
+                    query = get_user_features(date, self.history_horizon, self.percentile)
+                    features = self._load_chunk(query, 'features', date, getattr(get_user_features, '__name__', None))
+                    with self.profiler.stage('write_features', rows_in=len(features), day=date):
+                        features.write_parquet(os.path.join(self.features_path, f'{date}.pq'))
+
+                if include_sessions:
+                    get_intents = self.service['intents']
+                    query = get_intents(date, self.history_horizon, self.percentile)
+                    sessions = self._load_chunk(query, 'intents', date, getattr(get_intents, '__name__', None))
+                    sessions = self.profiler.call('clean_sessions', clean_sessions, sessions, day=date)
+                    with self.profiler.stage('write_sessions', rows_in=len(sessions), day=date):
+                        sessions.write_parquet(os.path.join(self.sessions_path, f'{date}.pq'))
 
         self.terminate()
+        self._write_manifest(dates, include_sessions, include_features)
+        if self.profiler.enabled:
+            self.profiler.print_summary()
         print(f'Data written to {self.features_path} and {self.sessions_path}')
@@ -647,6 +647,55 @@ def get_rh_features(date: str, days_back: int = 60, percentile: float = 0.8) ->
     """
 
 
+def get_rh_bookings(date: str, days_back: int = 60) -> str:
+    """Raw completed RH bookings behind get_rh_features, including the given date itself"""
+    return f"""
+        select
+            booking_id,
+            customer_id,
+            date_format(ts, '%Y-%m-%d %H:%i:%s') as ts,
+            pickup_lat,
+            pickup_long,
+            dropoff_lat,
+            dropoff_long
+        from (
+            select
+                booking_id,
+                customer_id,
+                case when booking_country = 'UAE' then at_timezone(
+                        cast(booking_creation_date as timestamp), 'Asia/Dubai'
+                    )
+                when booking_country = 'Jordan' then at_timezone(
+                        cast(booking_creation_date as timestamp), 'Asia/Amman'
+                    )
+                else null end as ts,
+                pickup_lat,
+                pickup_long,
+                dropoff_lat,
+                dropoff_long,
+                row_number() over(partition BY customer_id, booking_id ORDER BY booking_creation_date asc) as rank
+            from prod_dwh.booking
+            where 1=1
+                and day between date('{date}') - interval '{days_back + 1}' day and date('{date}')
+                and customer_id is not null
+                and booking_country in ('UAE', 'Jordan')
+                and not {_like_filter()}
+                and is_trip_ended
+                and not is_intercity
+                and not is_later
+                and dropoff_lat != 0
+                and dropoff_long != 0
+                and pickup_lat != 0
+                and pickup_long != 0
+                and booking_platform in ('ICMA','ACMA')
+                and customer_id != 20567159
+                and business_type in ('Ride Hailing','jv')
+        )
+        where rank = 1
+            and ts is not null
+    """
+
+
 def get_food_features(date: str, days_back: int = 60, percentile: float = 0.8) -> str:
     return f"""
         with base_bookings as (
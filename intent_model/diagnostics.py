@@ -0,0 +1,306 @@
+import os
+import json
+import numpy as np
+import pandas as pd
+import pyarrow.dataset as pads
+
+from tqdm import tqdm
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+try:
+    from .preprocessing._utils import TO_DROP, CAT, LABEL, WEIGHT
+except ImportError:
+    from preprocessing._utils import TO_DROP, CAT, LABEL, WEIGHT
+
+DATE_COL = 'valid_date'
+PSI_EPS = 1e-4  # floor of bin fractions, so empty bins do not make PSI infinite
+
+
+def psi(expected: np.ndarray, actual: np.ndarray, eps: float = PSI_EPS) -> float:
+    """Population stability index of two histograms over the same bins: sum (a - e) * ln(a / e) of bin fractions"""
+    e = np.maximum(np.asarray(expected, dtype=np.float64) / max(np.sum(expected), 1e-12), eps)
+    a = np.maximum(np.asarray(actual, dtype=np.float64) / max(np.sum(actual), 1e-12), eps)
+    return float(np.sum((a - e) * np.log(a / e)))
+
+
+def feature_ranges(dataset: pads.Dataset, features: Sequence[str]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    (low, high) of every feature from the parquet row group statistics, so histogram grids are known
+    before the data pass. Features without statistics are read alone (one column at a time).
+    """
+    low = np.full(len(features), np.inf)
+    high = np.full(len(features), -np.inf)
+    missing = set(range(len(features)))
+    for fragment in dataset.get_fragments():
+        metadata = fragment.metadata
+        names = metadata.schema.to_arrow_schema().names
+        for g in range(metadata.num_row_groups):
+            row_group = metadata.row_group(g)
+            for i, name in enumerate(features):
+                stats = row_group.column(names.index(name)).statistics
+                if stats is None or not stats.has_min_max:
+                    continue
+                low[i], high[i] = min(low[i], float(stats.min)), max(high[i], float(stats.max))
+                missing.discard(i)
+
+    for i in sorted(missing):
+        values = dataset.to_table(columns=[features[i]]).column(0).to_numpy(zero_copy_only=False).astype(np.float64)
+        low[i], high[i] = np.nanmin(values), np.nanmax(values)
+    return low, high
+
+
+class DailyHistograms(object):
+    """
+    Per-day histograms of features over fixed grids: resolution equal-width bins over [low, high]
+    (values outside go to the edge bins) plus a last bin of missing values.
+    Histograms of different chunks or processes are merged by addition; coarser bins for PSI are
+    built from the fine ones afterwards, see coarse_bins.
+    """
+    def __init__(self, features: Sequence[str], low: np.ndarray, high: np.ndarray, resolution: int = 1000):
+        assert len(features) == len(low) == len(high), 'One range per feature is needed'
+        self.features = list(features)
+        self.low = np.asarray(low, dtype=np.float64)
+        self.high = np.asarray(high, dtype=np.float64)
+        self.resolution = resolution
+        self.counts = {}  # date -> (features, resolution + 1)
+
+    def _bins(self, X: np.ndarray) -> np.ndarray:
+        width = np.where(self.high > self.low, self.high - self.low, 1.0)
+        with np.errstate(invalid='ignore'):
+            idx = np.floor((X - self.low) * (self.resolution / width))
+        idx = np.clip(idx, 0, self.resolution - 1)
+        return np.where(np.isnan(X), self.resolution, idx).astype(np.int64)
+
+    def update(self, dates: np.ndarray, X: np.ndarray) -> 'DailyHistograms':
+        """dates: day of every row, X: (rows, features) values in features order"""
+        keys, day = np.unique(np.asarray(dates).astype(str), return_inverse=True)
+        idx = self._bins(np.asarray(X, dtype=np.float64))
+        size = self.resolution + 1
+        for f in range(len(self.features)):
+            counts = np.bincount(day * size + idx[:, f], minlength=len(keys) * size).reshape(len(keys), size)
+            for k, key in enumerate(keys):
+                if key not in self.counts:
+                    self.counts[key] = np.zeros((len(self.features), size), dtype=np.float64)
+                self.counts[key][f] += counts[k]
+        return self
+
+    def merge(self, other: 'DailyHistograms') -> 'DailyHistograms':
+        assert self.features == other.features and self.resolution == other.resolution \
+            and np.array_equal(self.low, other.low) and np.array_equal(self.high, other.high), \
+            'Histograms have different grids'
+        for key, counts in other.counts.items():
+            if key in self.counts:
+                self.counts[key] = self.counts[key] + counts
+            else:
+                self.counts[key] = counts.copy()
+        return self
+
+    def __add__(self, other: 'DailyHistograms') -> 'DailyHistograms':
+        return self.copy().merge(other)
+
+    def copy(self) -> 'DailyHistograms':
+        hist = DailyHistograms(self.features, self.low, self.high, self.resolution)
+        hist.counts = {k: v.copy() for k, v in self.counts.items()}
+        return hist
+
+    @property
+    def dates(self) -> List[str]:
+        return sorted(self.counts)
+
+    def total(self, dates: Optional[Iterable[str]] = None) -> np.ndarray:
+        """(features, resolution + 1) histogram of the given dates (all by default)"""
+        dates = self.dates if dates is None else [str(x) for x in dates]
+        total = np.zeros((len(self.features), self.resolution + 1), dtype=np.float64)
+        for key in dates:
+            if key in self.counts:
+                total += self.counts[key]
+        return total
+
+    def coarse_bins(self, reference: np.ndarray, n_bins: int = 10) -> np.ndarray:
+        """
+        (features, resolution + 1) coarse bin of every fine bin: n_bins of about equal reference weight
+        (deciles by default, edges snapped to the grid), missing values in bin n_bins
+        """
+        values = reference[:, :-1]
+        middle = np.cumsum(values, axis=1) - values / 2
+        total = np.maximum(values.sum(axis=1, keepdims=True), 1e-12)
+        bins = np.minimum((middle * n_bins / total).astype(np.int64), n_bins - 1)
+        return np.concatenate([bins, np.full((len(self.features), 1), n_bins)], axis=1)
+
+    def psi(self, reference_dates: Optional[Iterable[str]] = None, n_bins: int = 10) -> pd.DataFrame:
+        """PSI of every day (rows) and feature (columns) against the reference dates (all dates by default)"""
+        reference = self.total(reference_dates)
+        bins = self.coarse_bins(reference, n_bins)
+
+        def coarse(hist: np.ndarray, f: int) -> np.ndarray:
+            return np.bincount(bins[f], weights=hist[f], minlength=n_bins + 1)
+
+        expected = [coarse(reference, f) for f in range(len(self.features))]
+        rows = [
+            [psi(expected[f], coarse(self.counts[key], f)) for f in range(len(self.features))]
+            for key in self.dates
+        ]
+        return pd.DataFrame(rows, index=pd.Index(self.dates, name=DATE_COL), columns=self.features)
+
+    def save(self, path: str) -> None:
+        dates = self.dates
+        counts = np.stack([self.counts[k] for k in dates]) if dates \
+            else np.zeros((0, len(self.features), self.resolution + 1))
+        np.savez(
+            path,
+            features=np.array(json.dumps(self.features)),
+            low=self.low,
+            high=self.high,
+            dates=np.array(json.dumps(dates)),
+            counts=counts
+        )
+
+    @classmethod
+    def load(cls, path: str) -> 'DailyHistograms':
+        with np.load(path, allow_pickle=False) as f:
+            hist = cls(json.loads(str(f['features'])), f['low'], f['high'], f['counts'].shape[2] - 1)
+            hist.counts = {key: f['counts'][k] for k, key in enumerate(json.loads(str(f['dates'])))}
+        return hist
+
+
+class FeatureDiagnostics(object):
+    """
+    Feature diagnostics of a dataset in one streaming pass:
+        - means, standard deviations and correlations from sums of cross-products of complete rows
+          (values shifted by the first chunk means, for numerical stability)
+        - VIF of every feature as the diagonal of the inverse correlation matrix, i.e. 1 / (1 - R^2)
+          of its regression with intercept on all others, without fitting one regression per feature
+        - per-day histograms for PSI across valid_date, see DailyHistograms
+
+    Unlike variance_inflation_factor on a raw matrix without a constant column (as in the notebook),
+    the VIF here is centered, so features with a large mean are not reported as collinear.
+    """
+    def __init__(self, features: Sequence[str], low: np.ndarray, high: np.ndarray, resolution: int = 1000):
+        self.features = list(features)
+        self.histograms = DailyHistograms(features, low, high, resolution)
+        self.rows = 0
+        self.complete_rows = 0
+        self.shift = None
+        self.sum = np.zeros(len(features), dtype=np.float64)
+        self.cross = np.zeros((len(features), len(features)), dtype=np.float64)
+
+    def update(self, dates: np.ndarray, X: np.ndarray) -> 'FeatureDiagnostics':
+        X = np.asarray(X, dtype=np.float64)
+        self.histograms.update(dates, X)
+        self.rows += len(X)
+
+        complete = X[~np.isnan(X).any(axis=1)]
+        if not len(complete):
+            return self
+        if self.shift is None:
+            self.shift = complete.mean(axis=0)
+        centered = complete - self.shift
+        self.complete_rows += len(complete)
+        self.sum += centered.sum(axis=0)
+        self.cross += centered.T @ centered
+        return self
+
+    def covariance(self) -> np.ndarray:
+        n = self.complete_rows
+        mean = self.sum / n
+        return (self.cross - n * np.outer(mean, mean)) / (n - 1)
+
+    def mean(self) -> np.ndarray:
+        return self.shift + self.sum / self.complete_rows
+
+    def std(self) -> np.ndarray:
+        return np.sqrt(np.maximum(np.diag(self.covariance()), 0.0))
+
+    def correlation(self) -> pd.DataFrame:
+        std = self.std()
+        with np.errstate(divide='ignore', invalid='ignore'):
+            corr = self.covariance() / np.outer(std, std)
+        np.fill_diagonal(corr, 1.0)
+        return pd.DataFrame(corr, index=self.features, columns=self.features)
+
+    def vif(self) -> pd.Series:
+        """VIF of every feature, inf for constant and perfectly collinear ones"""
+        vif = np.full(len(self.features), np.inf)
+        varying = self.std() > 0
+        corr = self.correlation().values[np.ix_(varying, varying)]
+        try:
+            vif[varying] = np.diag(np.linalg.inv(corr))
+        except np.linalg.LinAlgError:
+            pass
+        return pd.Series(vif, index=self.features, name='VIF')
+
+    def report(self, reference_dates: Optional[Iterable[str]] = None, n_bins: int = 10) -> dict:
+        histogram = self.histograms.total()
+        psi_table = self.histograms.psi(reference_dates, n_bins)
+        vif = self.vif()
+        std = self.std()
+        return {
+            'rows': self.rows,
+            'complete_rows': self.complete_rows,
+            'dates': self.histograms.dates,
+            'features': {
+                name: {
+                    'mean': float(self.mean()[i]),
+                    'std': float(std[i]),
+                    'missing': float(histogram[i, -1]),
+                    'low': float(self.histograms.low[i]),
+                    'high': float(self.histograms.high[i]),
+                    'vif': float(vif[name]),
+                    'max_psi': float(psi_table[name].max())
+                }
+                for i, name in enumerate(self.features)
+            },
+            'correlation': self.correlation().round(6).to_dict(),
+            'psi': psi_table.round(6).to_dict(orient='index')
+        }
+
+
+def run_diagnostics(
+        dataset_path: str,
+        output_path: Optional[str] = None,
+        features: Optional[Iterable[str]] = None,
+        reference_dates: Optional[Iterable[str]] = None,
+        resolution: int = 1000,
+        n_bins: int = 10,
+        batch_size: int = 100000,
+        vif_threshold: float = 10.0,
+        psi_threshold: float = 0.2
+) -> dict:
+    """
+    Diagnostics report of a prepared dataset (dataset.pq file or directory) in one pass over its
+    features and valid_date, see FeatureDiagnostics. Features are the numerical model inputs by default
+    (everything but TO_DROP, CAT, label and weight). PSI is computed per day against reference_dates
+    (e.g. the train split dates, all dates by default) on n_bins reference quantile bins.
+
+    The report is written as JSON to output_path (<dataset>_diagnostics.json by default), the
+    per-day histograms next to it as .npz, so PSI against other references needs no new pass.
+    """
+    dataset = pads.dataset(dataset_path, format='parquet')
+    if features is None:
+        features = [x for x in dataset.schema.names if x not in TO_DROP + CAT + [LABEL, WEIGHT]]
+    features = list(features)
+
+    low, high = feature_ranges(dataset, features)
+    diagnostics = FeatureDiagnostics(features, low, high, resolution)
+    for batch in tqdm(dataset.to_batches(columns=[DATE_COL] + features, batch_size=batch_size), desc='Diagnostics...'):
+        X = np.column_stack([
+            batch.column(name).to_numpy(zero_copy_only=False).astype(np.float64) for name in features
+        ]) if len(batch) else np.empty((0, len(features)))
+        diagnostics.update(batch.column(DATE_COL).to_numpy(zero_copy_only=False), X)
+
+    report = diagnostics.report(reference_dates, n_bins)
+    report['dataset'] = dataset_path
+
+    if output_path is None:
+        output_path = os.path.splitext(dataset_path.rstrip('/'))[0] + '_diagnostics.json'
+    with open(output_path, 'w') as f:
+        json.dump(report, f, indent=2)
+    diagnostics.histograms.save(os.path.splitext(output_path)[0] + '_histograms.npz')
+
+    for name, values in report['features'].items():
+        if values['vif'] > vif_threshold:
+            print(f'{name}: VIF {values["vif"]:.2f}')
+        if values['max_psi'] > psi_threshold:
+            print(f'{name}: max PSI {values["max_psi"]:.3f}')
+    print(f'Diagnostics of {len(features)} features over {report["rows"]} rows written to {output_path}')
+    return report
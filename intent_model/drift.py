@@ -0,0 +1,188 @@
+import os
+import json
+import numpy as np
+import pandas as pd
+import polars as pl
+
+from typing import Iterable, List, Optional, Sequence, Union
+
+try:
+    from .diagnostics import DailyHistograms, DATE_COL, psi
+    from .preprocessing._utils import TO_DROP, CAT, LABEL, WEIGHT
+except ImportError:
+    from diagnostics import DailyHistograms, DATE_COL, psi
+    from preprocessing._utils import TO_DROP, CAT, LABEL, WEIGHT
+
+SKETCH_DIR = 'sketches'
+
+
+def make_grid(
+        data: pd.DataFrame,
+        features: Optional[Iterable[str]] = None,
+        resolution: int = 1000,
+        tail: float = 0.001
+) -> DailyHistograms:
+    """
+    Empty sketch with the fixed grid of every feature: resolution bins between its tail and 1 - tail
+    quantiles in data (e.g. the training set), so a few outliers do not squeeze the bulk into one bin.
+    Numerical model inputs by default.
+    """
+    if features is None:
+        features = [x for x in data.columns if x not in TO_DROP + CAT + [LABEL, WEIGHT]]
+    features = list(features)
+    values = data[features].astype(np.float64)
+    return DailyHistograms(
+        features, values.quantile(tail).values, values.quantile(1 - tail).values, resolution
+    )
+
+
+def grid_from_report(report: Union[str, dict], resolution: int = 1000) -> DailyHistograms:
+    """Empty sketch over the feature ranges of a run_diagnostics report (dict or JSON path)"""
+    if isinstance(report, str):
+        with open(report) as f:
+            report = json.load(f)
+    features = list(report['features'])
+    low = [report['features'][x]['low'] for x in features]
+    high = [report['features'][x]['high'] for x in features]
+    return DailyHistograms(features, np.array(low), np.array(high), resolution)
+
+
+def save_grid(grid: DailyHistograms, path: str) -> None:
+    with open(path, 'w') as f:
+        json.dump({
+            'features': grid.features,
+            'low': grid.low.tolist(),
+            'high': grid.high.tolist(),
+            'resolution': grid.resolution
+        }, f, indent=2)
+
+
+def load_grid(path: str) -> DailyHistograms:
+    with open(path) as f:
+        grid = json.load(f)
+    return DailyHistograms(grid['features'], np.array(grid['low']), np.array(grid['high']), grid['resolution'])
+
+
+def _feature_matrix(frame: Union[pl.DataFrame, pd.DataFrame], features: Sequence[str]) -> np.ndarray:
+    if isinstance(frame, pd.DataFrame):
+        return frame[list(features)].astype(np.float64).values
+    return frame.select([pl.col(x).cast(pl.Float64) for x in features]).to_numpy()
+
+
+def write_sketches(
+        frame: Union[pl.DataFrame, pd.DataFrame],
+        grid: DailyHistograms,
+        path: str,
+        date: Optional[str] = None
+) -> List[str]:
+    """
+    Sketches the grid features of frame per valid_date (or all rows as date) into
+    path/sketches/<date>.npz, replacing sketches of the same days. Returns the dates written.
+    """
+    sketch = DailyHistograms(grid.features, grid.low, grid.high, grid.resolution)
+    X = _feature_matrix(frame, grid.features)
+    if date is not None:
+        dates = np.full(len(X), str(date))
+    elif isinstance(frame, pd.DataFrame):
+        dates = frame[DATE_COL].astype(str).values
+    else:
+        dates = frame[DATE_COL].cast(pl.Utf8).to_numpy()
+    sketch.update(dates, X)
+
+    os.makedirs(os.path.join(path, SKETCH_DIR), exist_ok=True)
+    for key in sketch.dates:
+        day = DailyHistograms(grid.features, grid.low, grid.high, grid.resolution)
+        day.counts[key] = sketch.counts[key]
+        day.save(os.path.join(path, SKETCH_DIR, f'{key}.npz'))
+    return sketch.dates
+
+
+def load_sketches(path: str, dates: Optional[Iterable[str]] = None) -> DailyHistograms:
+    """Merged daily sketches of path/sketches (or of the given dates only)"""
+    directory = os.path.join(path, SKETCH_DIR)
+    available = sorted(x.replace('.npz', '') for x in os.listdir(directory) if x.endswith('.npz'))
+    if dates is not None:
+        dates = set(str(x) for x in dates)
+        available = [x for x in available if x in dates]
+    assert available, f'No sketches in {directory}'
+    return sum(
+        (DailyHistograms.load(os.path.join(directory, f'{x}.npz')) for x in available[1:]),
+        DailyHistograms.load(os.path.join(directory, f'{available[0]}.npz'))
+    )
+
+
+def ks_statistic(expected: np.ndarray, actual: np.ndarray) -> float:
+    """
+    Kolmogorov-Smirnov statistic of two fine-grid histograms (missing bin excluded), evaluated at the
+    grid edges: below the exact one by at most the largest bin fraction
+    """
+    e, a = np.cumsum(expected[:-1]), np.cumsum(actual[:-1])
+    if e[-1] == 0 or a[-1] == 0:
+        return 0.0
+    return float(np.max(np.abs(e / e[-1] - a / a[-1])))
+
+
+class DriftMonitor(object):
+    """
+    Day-over-day drift of the sketched features: every day is compared with the pooled sketches of
+    the baseline_days days before it (only days with sketches count) by PSI on n_bins baseline
+    quantile bins, KS statistic on the fine grid and missing rate.
+    Works on the stored sketches only, so no data is rescanned.
+    """
+    def __init__(
+            self,
+            path: str,
+            baseline_days: int = 28,
+            n_bins: int = 10,
+            psi_threshold: float = 0.2,
+            ks_threshold: float = 0.1
+    ):
+        self.sketches = load_sketches(path)
+        self.baseline_days = baseline_days
+        self.n_bins = n_bins
+        self.psi_threshold = psi_threshold
+        self.ks_threshold = ks_threshold
+
+    @property
+    def dates(self) -> List[str]:
+        return self.sketches.dates
+
+    def baseline_dates(self, date: str) -> List[str]:
+        return [x for x in self.dates if x < str(date)][-self.baseline_days:]
+
+    def compare(self, date: Optional[str] = None) -> pd.DataFrame:
+        """Drift of every feature on date (the last sketched day by default) against its baseline"""
+        date = self.dates[-1] if date is None else str(date)
+        assert date in self.sketches.counts, f'No sketch for {date}'
+        baseline_dates = self.baseline_dates(date)
+        assert baseline_dates, f'No baseline days before {date}'
+
+        baseline = self.sketches.total(baseline_dates)
+        current = self.sketches.counts[date]
+        bins = self.sketches.coarse_bins(baseline, self.n_bins)
+
+        rows = []
+        for f, name in enumerate(self.sketches.features):
+            expected = np.bincount(bins[f], weights=baseline[f], minlength=self.n_bins + 1)
+            actual = np.bincount(bins[f], weights=current[f], minlength=self.n_bins + 1)
+            rows.append({
+                'feature': name,
+                'psi': psi(expected, actual),
+                'ks': ks_statistic(baseline[f], current[f]),
+                'missing_rate': float(current[f, -1] / max(current[f].sum(), 1e-12)),
+                'baseline_missing_rate': float(baseline[f, -1] / max(baseline[f].sum(), 1e-12)),
+                'rows': float(current[f].sum())
+            })
+
+        report = pd.DataFrame(rows).set_index('feature')
+        report['drift'] = (report['psi'] > self.psi_threshold) | (report['ks'] > self.ks_threshold)
+        report.attrs['date'] = date
+        report.attrs['baseline'] = (baseline_dates[0], baseline_dates[-1], len(baseline_dates))
+        return report
+
+    def history(self, dates: Optional[Iterable[str]] = None, metric: str = 'psi') -> pd.DataFrame:
+        """metric of every day (rows) and feature (columns), each day against its own rolling baseline"""
+        dates = self.dates[1:] if dates is None else [str(x) for x in dates]
+        return pd.DataFrame(
+            {date: self.compare(date)[metric] for date in dates if self.baseline_dates(date)}
+        ).T.rename_axis(DATE_COL)
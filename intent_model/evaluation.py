@@ -0,0 +1,125 @@
+import numpy as np
+import pandas as pd
+
+from typing import Iterable, Optional
+
+try:
+    from .preprocessing._utils import BOUNDS_DICT
+except ImportError:
+    from preprocessing._utils import BOUNDS_DICT
+
+SEGMENT_KEYS = ('country', 'is_home', 'is_weekend', 'hour_bucket', 'valid_date')
+
+
+def add_segments(data: pd.DataFrame, hour_bucket_size: int = 3) -> pd.DataFrame:
+    """Adds country (from coordinates, country_name is dropped by read_data) and hour_bucket columns"""
+    data['country'] = 'unknown'
+    for country, ((lat_min, lat_max), (long_min, long_max)) in BOUNDS_DICT.items():
+        in_bounds = data['latitude'].between(lat_min, lat_max) & data['longitude'].between(long_min, long_max)
+        data.loc[in_bounds, 'country'] = country
+
+    start = pd.to_datetime(data['ts']).dt.hour // hour_bucket_size * hour_bucket_size
+    data['hour_bucket'] = start.map(lambda h: f'{h:02d}-{h + hour_bucket_size:02d}')
+    return data
+
+
+class _ScoredSessions(object):
+    """Per-row quantities shared by all segmentations, computed once"""
+    def __init__(self, data: pd.DataFrame, scores: np.ndarray, label_col: str, threshold: float, n_bins: int):
+        scores = np.asarray(scores)
+        self.n = len(scores)
+        self.scores = scores.astype(np.float64)
+        self.y = data[label_col].values == 1
+        self.rh = data['rh'].values == 1
+        self.freq = data['is_freq'].values == 1
+        self.relevant = self.rh & self.freq
+        self.above = self.scores > threshold
+        self.n_bins = n_bins
+
+        eps = np.finfo(scores.dtype if scores.dtype.kind == 'f' else np.float64).eps
+        p = np.clip(self.scores, eps, 1 - eps)  # as sklearn.metrics.log_loss
+        self.loss = -np.where(self.y, np.log(p), np.log(1 - p))
+        self.bins = np.clip((self.scores * n_bins).astype(np.int64), 0, n_bins - 1)
+
+        # one descending sort for all segments; tie blocks get one dense rank
+        self.order = np.argsort(-self.scores, kind='stable')
+        sorted_scores = self.scores[self.order]
+        self.score_rank = np.r_[0, np.cumsum(np.diff(sorted_scores) != 0)]
+        self.y_sorted = self.y[self.order]
+
+    def _average_precision(self, codes: np.ndarray, n_groups: int, positives: np.ndarray) -> np.ndarray:
+        codes_sorted = codes[self.order]
+        groups = pd.Series(self.y_sorted.astype(np.int64)).groupby(codes_sorted)
+        tp = groups.cumsum().values
+        rank = groups.cumcount().values + 1
+
+        # precision is taken at the end of each block of tied scores, as sklearn does
+        block = codes_sorted * (self.score_rank[-1] + 1) + self.score_rank
+        tp = pd.Series(tp).groupby(block).transform('max').values
+        rank = pd.Series(rank).groupby(block).transform('max').values
+
+        pos = self.y_sorted
+        ap = np.bincount(codes_sorted[pos], weights=tp[pos] / rank[pos], minlength=n_groups)
+        return ap / np.maximum(positives, 1)
+
+    def metrics(self, codes: np.ndarray, n_groups: int) -> pd.DataFrame:
+        def count(weights: Optional[np.ndarray] = None) -> np.ndarray:
+            return np.bincount(codes, weights=weights, minlength=n_groups)
+
+        sessions = count()
+        positives = count(self.y)
+        rh, relevant = count(self.rh), count(self.relevant)
+        # as get_relevance: relevant sessions above the threshold by is_freq, the total by rh and is_freq
+        above, rh_above, relevant_above = count(self.above), count(self.above & self.rh), \
+            count(self.above & self.freq)
+
+        cells = codes * self.n_bins + self.bins
+        cell_gap = np.abs(
+            np.bincount(cells, weights=self.scores, minlength=n_groups * self.n_bins) -
+            np.bincount(cells, weights=self.y, minlength=n_groups * self.n_bins)
+        ).reshape(n_groups, self.n_bins)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return pd.DataFrame({
+                'sessions': sessions.astype(np.int64),
+                'rh_sessions': rh.astype(np.int64),
+                'sa_coverage': above / sessions,
+                'rh_coverage': rh_above / rh,
+                'relevance (rh total)': rh_above / above,
+                'relevance (freq only)': relevant_above / above,
+                '% of freq detected': relevant_above / relevant,
+                'pr_auc': np.where(positives > 0, self._average_precision(codes, n_groups, positives), np.nan),
+                'log_loss': count(self.loss) / sessions,
+                'ece': cell_gap.sum(axis=1) / sessions
+            })
+
+
+def evaluate_segments(
+        data: pd.DataFrame,
+        scores: Optional[np.ndarray] = None,
+        keys: Iterable[str] = SEGMENT_KEYS,
+        threshold: float = 0.5,
+        score_col: str = 'score',
+        label_col: str = 'target',
+        n_bins: int = 15
+) -> pd.DataFrame:
+    """
+    Coverage and relevance at threshold (as in get_relevance), PR-AUC, log loss and expected
+    calibration error (n_bins uniform bins) for every value of every key, plus an 'all' row.
+
+    Returns a tidy table with one row per (segment, value). Per-row losses, calibration bins and
+    the score sort are computed once; every key then only costs a few grouped sums.
+    """
+    if scores is None:
+        scores = data[score_col].values
+
+    sessions = _ScoredSessions(data, scores, label_col, threshold, n_bins)
+    result = [sessions.metrics(np.zeros(sessions.n, dtype=np.int64), 1).assign(segment='all', value='all')]
+
+    for key in keys:
+        codes, uniques = pd.factorize(data[key], use_na_sentinel=False)
+        result.append(sessions.metrics(codes.astype(np.int64), len(uniques)).assign(segment=key, value=uniques))
+
+    result = pd.concat(result, ignore_index=True)
+    result['value'] = result['value'].astype(str)
+    return result[['segment', 'value'] + [x for x in result.columns if x not in ('segment', 'value')]]
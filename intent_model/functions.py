@@ -1,49 +1,51 @@
 import numpy as np
 import pandas as pd
-import tensorflow_decision_forests as tfdf
 
-from typing import Iterable, Tuple, Union, Any
-from tqdm import tqdm
+from typing import TYPE_CHECKING, Iterable, Optional, Tuple, Union, Any
 
-from sklearn.metrics import precision_recall_curve
+if TYPE_CHECKING:
+    import tensorflow_decision_forests as tfdf
 
 
-def get_relevance(
+def get_relevance_from_scores(
         data: pd.DataFrame,
-        X: pd.DataFrame,
-        model: Union[tfdf.keras.GradientBoostedTreesModel, Any],
-        thresholds: Iterable[float] = (0.4, 0.5, 0.6, 0.7, 0.8, 0.9)
+        scores: np.ndarray,
+        thresholds: Optional[Iterable[float]] = (0.4, 0.5, 0.6, 0.7, 0.8, 0.9)
 ) -> pd.DataFrame:
-    if hasattr(model, 'predict_proba'):
-        scores = model.predict_proba(X)[:, 1]
-    else:
-        scores = model.predict(X, verbose=0).flatten()
-
-    sub = data[['ts', 'target', 'is_freq', 'rh']].copy()
-    sub['score'] = scores
-    n_sessions = len(data)
-    n_rh_sessions = len(data[data.rh == 1])
-    n_relevant_sessions = len(data[(data.rh == 1) & (data.is_freq == 1)])
+    """
+    Same table as get_relevance for precomputed scores.
+    Scores are sorted once and counts above each threshold are read from cumulative sums,
+    so any number of thresholds costs one searchsorted. thresholds=None uses every unique score.
+    """
+    scores = np.asarray(scores, dtype=np.float64).flatten()
+    order = np.argsort(scores, kind='stable')
+    sorted_scores = scores[order]
+    rh = (data['rh'].values == 1)[order]
+    freq = (data['is_freq'].values == 1)[order]
+    n_relevant_sessions = (rh & freq).sum()
 
-    d_dict = {
-        'threshold': [],
-        'sessions': [],
-        'rh_sessions': [],
-        'relevant_sessions': []
-    }
+    # number of positives among the sessions strictly above sorted_scores[i - 1]
+    rh_above = np.concatenate([[0], np.cumsum(rh[::-1])])[::-1]
+    freq_above = np.concatenate([[0], np.cumsum(freq[::-1])])[::-1]
 
-    for t in tqdm(thresholds):
-        d_dict['threshold'].append(t)
-        d_dict['sessions'].append(len(sub[sub.score > t]))
-        d_dict['rh_sessions'].append(len(sub[(sub.score > t) & (sub.rh == 1)]))
-        d_dict['relevant_sessions'].append(len(sub[(sub.score > t) & (sub.is_freq == 1)]))
+    if thresholds is None:
+        thresholds = np.unique(sorted_scores)
+    thresholds = np.asarray(list(thresholds), dtype=np.float64)
+    first_above = np.searchsorted(sorted_scores, thresholds, side='right')
 
-    res_df = pd.DataFrame(d_dict)
+    n_sessions = len(scores)
+    res_df = pd.DataFrame({
+        'threshold': thresholds,
+        'sessions': n_sessions - first_above,
+        'rh_sessions': rh_above[first_above],
+        # as in get_relevance: sessions above the threshold with is_freq, rh or not
+        'relevant_sessions': freq_above[first_above]
+    })
     res_df['relevance (rh total)'] = res_df['rh_sessions'] / res_df['sessions']
     res_df['relevance (freq only)'] = res_df['relevant_sessions'] / res_df['sessions']
     res_df['% of freq detected'] = res_df['relevant_sessions'] / n_relevant_sessions
     res_df['sa_coverage'] = res_df['sessions'] / n_sessions
-    res_df['rh_coverage'] = res_df['rh_sessions'] / n_rh_sessions
+    res_df['rh_coverage'] = res_df['rh_sessions'] / rh.sum()
 
     return res_df[[
         'threshold',
@@ -55,11 +57,27 @@ def get_relevance(
     ]]
 
 
+def get_relevance(
+        data: pd.DataFrame,
+        X: pd.DataFrame,
+        model: Union['tfdf.keras.GradientBoostedTreesModel', Any],
+        thresholds: Iterable[float] = (0.4, 0.5, 0.6, 0.7, 0.8, 0.9)
+) -> pd.DataFrame:
+    if hasattr(model, 'predict_proba'):
+        scores = model.predict_proba(X)[:, 1]
+    else:
+        scores = model.predict(X, verbose=0).flatten()
+
+    return get_relevance_from_scores(data, scores, thresholds)
+
+
 def get_optimal_threshold(
         y_true: np.ndarray,
         y_pred: np.ndarray,
         target_precision: float = 0.90
 ) -> Tuple[float, float]:
+    from sklearn.metrics import precision_recall_curve
+
     precision, recall, thresholds = precision_recall_curve(y_true, y_pred)
     max_recall = np.max(recall[np.where(precision >= target_precision)[0]])
     index = np.where(recall == max_recall)[0][0]
@@ -16,3 +16,15 @@ BOUNDS_DICT = {
 VALID_SERVICE_AREA_IDS = ('1', '21', '64', '68', '111', '87', '49', '47')
 
 D_THRESHOLD = 0.2  # 200m threshold for all distance-based features
+
+# training data layout, as in model_training.ipynb
+TO_DROP = [
+    'valid_date', 'ts', 'sessionuuid', 'customer_id', 'booking_id',
+    'is_trip_ended', 'rh', 'is_freq', 'service', 'has_saved', 'weekday', 'is_work',
+]
+
+CAT = ['is_home', 'is_weekend']
+
+LABEL = 'target'
+
+WEIGHT = 'sample_weight'
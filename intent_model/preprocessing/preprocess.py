@@ -3,6 +3,7 @@ import polars as pl
 import pandas as pd
 
 from tqdm import tqdm
+from typing import Iterable, Iterator, List, Optional, Tuple
 
 try:
     from .filters import filter_invalid_locations, filter_invalid_service_area_id
@@ -13,6 +14,7 @@ try:
         dict_stats_to_norm_cols,
         denoise_hour_stats
     )
+    from ..profiling import StageProfiler, NULL_PROFILER
 except ImportError:
     from filters import filter_invalid_locations, filter_invalid_service_area_id
     from preprocess_functions import (
@@ -22,6 +24,7 @@ except ImportError:
         dict_stats_to_norm_cols,
         denoise_hour_stats
     )
+    from profiling import StageProfiler, NULL_PROFILER
 
 
 def _deduplicate_data(frame: pl.DataFrame) -> pl.DataFrame:
@@ -38,25 +41,25 @@ def _deduplicate_data(frame: pl.DataFrame) -> pl.DataFrame:
     return pl.concat([rh_frame, sa_frame], how='vertical').sort(by=['ts'])
 
 
-def process_day(frame: pl.DataFrame, melt_dicts: bool) -> pl.DataFrame:
-    frame = process_time(frame)
+def process_day(
+        frame: pl.DataFrame,
+        melt_dicts: bool,
+        profiler: StageProfiler = NULL_PROFILER,
+        **context
+) -> pl.DataFrame:
+    frame = profiler.call('process_time', process_time, frame, **context)
     frame = frame.with_columns(pl.col('booking_id').ne(0).cast(pl.Int64).alias('rh'))
 
     if melt_dicts:
-        frame = melt_stats(frame)
+        frame = profiler.call('melt_stats', melt_stats, frame, **context)
 
-    frame = process_locations(frame)
+    frame = profiler.call('process_locations', process_locations, frame, **context)
     frame = frame.with_columns((pl.col('num_trips') / pl.col('trx_amt')).alias('rh_frac'))
     frame = frame.drop(['num_trips', 'trx_amt'])
     return frame
 
 
-def read_data(
-        path: str,
-        min_index: int = None,
-        max_index: int = None,
-        melt_dicts: bool = False
-) -> pd.DataFrame:
+def _list_files(path: str, min_index: int = None, max_index: int = None) -> List[str]:
     features_filenames = sorted([x for x in os.listdir(os.path.join(path, 'features')) if '.pq' in x])
     sessions_filenames = sorted([x for x in os.listdir(os.path.join(path, 'sessions')) if '.pq' in x])
 
@@ -71,36 +74,124 @@ def read_data(
 
     assert len(features_filenames) == len(sessions_filenames), 'Files count does not match!'
 
-    df = []
-
-    for f_filename, s_filename in tqdm(
-            zip(features_filenames, sessions_filenames), 'Reading and processing data...', total=len(features_filenames)
-    ):
+    for f_filename, s_filename in zip(features_filenames, sessions_filenames):
         assert f_filename == s_filename, f'Filenames {f_filename} and {s_filename} do not match!'
 
-        sessions = pl.read_parquet(os.path.join(os.path.join(path, 'sessions'), s_filename))
-        features = pl.read_parquet(os.path.join(os.path.join(path, 'features'), f_filename))
+    return features_filenames
 
-        features = denoise_hour_stats(features)
 
-        for col in ['week_stats', 'hour_stats', 'hour_denoised_stats']:
-            if col in features.columns:
+def read_day(
+        path: str,
+        filename: str,
+        melt_dicts: bool = False,
+        profiler: StageProfiler = NULL_PROFILER
+) -> pl.DataFrame:
+    day = filename.replace('.pq', '')
+    sessions_path = os.path.join(os.path.join(path, 'sessions'), filename)
+    features_path = os.path.join(os.path.join(path, 'features'), filename)
+    sessions = profiler.call('read_sessions', pl.read_parquet, sessions_path, day=day)
+    features = profiler.call('read_features', pl.read_parquet, features_path, day=day)
+
+    features = profiler.call('denoise_hour_stats', denoise_hour_stats, features, day=day)
+
+    for col in ['week_stats', 'hour_stats', 'hour_denoised_stats']:
+        if col in features.columns:
+            with profiler.stage('dict_stats_to_norm_cols', rows_in=len(features), day=day, column=col) as s:
                 features = dict_stats_to_norm_cols(features, col=col, prefix=col.replace('_stats', ''))
+                s.rows_out = len(features)
 
+    with profiler.stage('join', rows_in=len(sessions), day=day) as s:
         sub = sessions.join(features, on=['valid_date', 'customer_id'], how='inner')
-        sub = process_day(sub, melt_dicts)
+        s.rows_out = len(sub)
+    sub = process_day(sub, melt_dicts, profiler, day=day)
+    with profiler.stage('filter_distance', rows_in=len(sub), day=day) as s:
         sub = sub.filter(pl.col('min_dist_to_known_loc') <= 40)  # user is too far away from usual location
-        df.append(sub)
+        s.rows_out = len(sub)
+    return sub
+
+
+def _clean_data(
+        frame: pl.DataFrame,
+        verbose: bool = True,
+        profiler: StageProfiler = NULL_PROFILER,
+        **context
+) -> pl.DataFrame:
+    if verbose:
+        print('Removing duplicated data...')
+    frame = profiler.call('deduplicate', _deduplicate_data, frame, **context)
+
+    if verbose:
+        print('Filtering invalid data...')
+    frame = profiler.call('filter_invalid_service_area_id', filter_invalid_service_area_id, frame, **context)
+    frame = profiler.call('filter_invalid_locations', filter_invalid_locations, frame, **context)
+    return frame.drop(['country_name', 'service_area_id'])
+
+
+def iter_days(
+        path: str,
+        min_index: int = None,
+        max_index: int = None,
+        melt_dicts: bool = False,
+        skip_dates: Iterable[str] = (),
+        profiler: StageProfiler = NULL_PROFILER
+) -> Iterator[Tuple[str, pl.DataFrame]]:
+    """
+    Yields (date, frame) per daily file with the same processing as read_data.
+    Deduplication is done within each day as in read_data. A session already yielded on an earlier
+    day is dropped from later days, so every sessionuuid is yielded once. read_data dedups the whole
+    range at once instead and may keep the later row, e.g. an rh row over an earlier sa row of the
+    same session. Sessions of skip_dates are not tracked.
+    """
+    skip_dates = set(skip_dates)
+    seen = None
+    for filename in _list_files(path, min_index, max_index):
+        day = filename.replace('.pq', '')
+        if day in skip_dates:
+            continue
+        with profiler.stage('day', day=day) as s:
+            frame = _clean_data(read_day(path, filename, melt_dicts, profiler), False, profiler, day=day)
+            if seen is not None:
+                frame = frame.filter(~pl.col('sessionuuid').is_in(seen))
+            seen = frame['sessionuuid'] if seen is None else pl.concat([seen, frame['sessionuuid']])
+            s.rows_out = len(frame)
+        yield day, frame
 
-    frame = pl.concat(df, how='vertical')
 
-    print('Removing duplicated data...')
-    frame = _deduplicate_data(frame)
+def read_data(
+        path: str,
+        min_index: int = None,
+        max_index: int = None,
+        melt_dicts: bool = False,
+        drift_grid: Optional[str] = None,
+        profiler: StageProfiler = NULL_PROFILER
+) -> pd.DataFrame:
+    """
+    drift_grid: grid JSON (see drift.save_grid), daily feature sketches are then written to path/sketches
+    profiler: StageProfiler to time every processing stage per day (disabled by default)
+    """
+    filenames = _list_files(path, min_index, max_index)
+    df = []
+
+    for filename in tqdm(filenames, 'Reading and processing data...', total=len(filenames)):
+        with profiler.stage('day', day=filename.replace('.pq', '')) as s:
+            df.append(read_day(path, filename, melt_dicts, profiler))
+            s.rows_out = len(df[-1])
 
-    print('Filtering invalid data...')
-    frame = filter_invalid_service_area_id(frame)
-    frame = filter_invalid_locations(frame)
-    frame = frame.drop(['country_name', 'service_area_id'])
+    frame = profiler.call('concat', lambda x: pl.concat(x, how='vertical'), df)
+    frame = _clean_data(frame, profiler=profiler)
 
+    if drift_grid is not None:
+        try:
+            from ..drift import load_grid, write_sketches
+        except ImportError:
+            from drift import load_grid, write_sketches
+
+        with profiler.stage('write_sketches', rows_in=len(frame)):
+            dates = write_sketches(frame, load_grid(drift_grid), path)
+        print(f'Sketches of {len(dates)} days written')
+
+    frame = profiler.call('to_pandas', pl.DataFrame.to_pandas, frame)
+    if profiler.enabled:
+        profiler.print_summary()
     print('Done.')
-    return frame.to_pandas()
+    return frame
@@ -1,11 +1,10 @@
 import json
 import numpy as np
 import polars as pl
-import geopy.distance
 
 from typing import Tuple
 from datetime import datetime
-from geopy.point import Point
+from functools import lru_cache
 from numba import jit
 
 try:
@@ -14,7 +13,15 @@ except ImportError:
     from _utils import TZ_DICT, D_THRESHOLD, WEEKEND_DICT
 
 
-@jit(nopython=True)
+@lru_cache(maxsize=None)
+def _geopy() -> tuple:
+    """(Point, great_circle), geopy is imported on first use"""
+    from geopy.distance import great_circle
+    from geopy.point import Point
+    return Point, great_circle
+
+
+@jit(nopython=True, nogil=True, cache=True)
 def fast_normalize(v: np.ndarray) -> np.ndarray:
     assert len(v.shape) == 2, "Single dimention array is not supported"
     # gives 40% better performance than sklearn.preprocessing.normalize
@@ -122,13 +129,15 @@ def _is_from_freq(row: dict, locations: dict) -> int:
     if row['dropoff_lat'] == 0 or row['dropoff_long'] == 0:
         return 0
     else:
+        Point, great_circle = _geopy()
         dropoff = Point(latitude=row['dropoff_lat'], longitude=row['dropoff_long'])
         freq_loc = [Point(latitude=float(x.split('|')[0]), longitude=float(x.split('|')[1])) for x in locations.keys()]
-        distances = [geopy.distance.great_circle(x, dropoff).km for x in freq_loc]
+        distances = [great_circle(x, dropoff).km for x in freq_loc]
         return int(min(distances) <= D_THRESHOLD)
 
 
-def _distance_known_location(locations: dict, current_location: Point) -> Tuple[float, float]:
+def _distance_known_location(locations: dict, current_location: 'Point') -> Tuple[float, float]:
+    Point, great_circle = _geopy()
     p2s = [Point(latitude=float(x.split('|')[0]), longitude=float(x.split('|')[1])) for x in locations.keys()]
     v = fast_normalize(np.expand_dims(np.array(list(locations.values())), axis=0))[0]  # list(locations.values())
 
@@ -136,7 +145,7 @@ def _distance_known_location(locations: dict, current_location: Point) -> Tuple[
     ind = None
 
     for i, p2 in enumerate(p2s):
-        dist = geopy.distance.great_circle(p2, current_location).km
+        dist = great_circle(p2, current_location).km
         if min_d is None:
             min_d = dist
             ind = i
@@ -151,7 +160,8 @@ def _distance_known_location(locations: dict, current_location: Point) -> Tuple[
         return min_d, 0.0
 
 
-def _most_freq_dist(locations: dict, current_location: Point) -> Tuple[float, float]:
+def _most_freq_dist(locations: dict, current_location: 'Point') -> Tuple[float, float]:
+    Point, great_circle = _geopy()
     freq = sorted(
         [((float(k.split('|')[0]), float(k.split('|')[1])), v) for k, v in locations.items()],
         key=lambda x: x[1],
@@ -160,12 +170,13 @@ def _most_freq_dist(locations: dict, current_location: Point) -> Tuple[float, fl
     most_freq = Point(latitude=freq[0][0][0], longitude=freq[0][0][1])
     second_freq = Point(latitude=freq[1][0][0], longitude=freq[1][0][1])
     return (
-        geopy.distance.great_circle(most_freq, current_location).km,
-        geopy.distance.great_circle(second_freq, current_location).km
+        great_circle(most_freq, current_location).km,
+        great_circle(second_freq, current_location).km
     )
 
 
 def _get_locations_features(row: dict) -> dict:
+    Point, _ = _geopy()
     locations = json.loads(row['locations'])
     current = Point(latitude=row['latitude'], longitude=row['longitude'])
     min_d, v = _distance_known_location(locations=locations, current_location=current)
@@ -180,6 +191,7 @@ def _get_locations_features(row: dict) -> dict:
 
 
 def _saved_locations_process(row: dict) -> dict:
+    Point, great_circle = _geopy()
     current = Point(latitude=row['latitude'], longitude=row['longitude'])
     home_coords = Point(
         latitude=row['home_work_coords']['home']['lat'],
@@ -195,10 +207,10 @@ def _saved_locations_process(row: dict) -> dict:
     work_dist = np.inf
 
     if home_coords.latitude != 0.0:
-        home_dist = geopy.distance.great_circle(home_coords, current).km
+        home_dist = great_circle(home_coords, current).km
 
     elif work_coords.latitude != 0.0:
-        work_dist = geopy.distance.great_circle(work_coords, current).km
+        work_dist = great_circle(work_coords, current).km
 
     else:
         return result
@@ -0,0 +1,216 @@
+import os
+import json
+import numpy as np
+import pandas as pd
+import pyarrow.dataset as pads
+
+from tqdm import tqdm
+from typing import Callable, Dict, Iterable, List, Optional, Sequence
+
+try:
+    from ._utils import TO_DROP, CAT, LABEL, WEIGHT
+    from .targets import add_sample_weight, rh_vs_rest_target
+except ImportError:
+    from _utils import TO_DROP, CAT, LABEL, WEIGHT
+    from targets import add_sample_weight, rh_vs_rest_target
+
+SCHEMA_FILE = 'schema.json'
+SPLIT_NAMES = ('train', 'val', 'test')
+
+
+def split_dates(
+        dates: Iterable[str],
+        counts: Sequence[int] = (60, 15),
+        names: Sequence[str] = SPLIT_NAMES
+) -> Dict[str, List[str]]:
+    """Consecutive splits of the sorted unique dates: counts[i] dates for names[i], the rest for the last name"""
+    assert len(names) == len(counts) + 1, 'One more name than counts is needed'
+    dates = sorted(set(dates))
+    bounds = np.cumsum([0] + list(counts) + [len(dates)])
+    bounds = np.minimum(bounds, len(dates))
+    return {name: dates[bounds[i]:bounds[i + 1]] for i, name in enumerate(names)}
+
+
+class _ShardWriter(object):
+    """Appends float32 records to part-xxxxx.bin files of at most rows_per_shard rows"""
+    def __init__(self, path: str, rows_per_shard: int):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.rows_per_shard = rows_per_shard
+        self.shards = []
+        self.rows = 0
+        self._file = None
+        self._shard_rows = 0
+
+    def write(self, records: np.ndarray) -> None:
+        records = np.ascontiguousarray(records, dtype='<f4')
+        while len(records):
+            if self._file is None or self._shard_rows == self.rows_per_shard:
+                self._open()
+            n = min(len(records), self.rows_per_shard - self._shard_rows)
+            records[:n].tofile(self._file)
+            self._shard_rows += n
+            self.rows += n
+            records = records[n:]
+
+    def _open(self) -> None:
+        self.close()
+        name = f'part-{len(self.shards):05d}.bin'
+        self._file = open(os.path.join(self.path, name), 'wb')
+        self._shard_rows = 0
+        self.shards.append(name)
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def _to_records(frame: pd.DataFrame, columns: List[str], vocabularies: Dict[str, List[str]]) -> np.ndarray:
+    records = np.empty((len(frame), len(columns)), dtype=np.float32)
+    for i, name in enumerate(columns):
+        if name in vocabularies:
+            mapping = {item: j for j, item in enumerate(vocabularies[name])}
+            records[:, i] = frame[name].astype(str).map(mapping).values
+        else:
+            records[:, i] = frame[name].values
+    return records
+
+
+def write_shards(
+        dataset_path: str,
+        output_path: str,
+        splits: Optional[Dict[str, Iterable[str]]] = None,
+        to_drop: Iterable[str] = TO_DROP,
+        categorical: Iterable[str] = CAT,
+        weighted_splits: Iterable[str] = ('train',),
+        rows_per_shard: int = 1000000,
+        batch_size: int = 100000,
+        target_fn: Callable[[pd.DataFrame], pd.DataFrame] = rh_vs_rest_target
+) -> dict:
+    """
+    Writes model-ready shards of dataset_path (dataset.pq file or directory) per split of valid_date
+    (split_dates(...) by default, i.e. 60/15/rest): output_path/<split>/part-xxxxx.bin files of
+    little-endian float32 records [features..., label, sample_weight], described by schema.json.
+
+    dataset.pq has no label: target_fn (one of the targets helpers, as in model_training.ipynb) builds
+    it per batch from the source columns rh / is_freq, which are read even though they are in to_drop.
+    Other columns in to_drop are never read. Categorical columns are stored as indices into their
+    vocabulary (the str values, as in training) and turned back into strings by shard_dataset.
+    Rows are streamed in batches of batch_size, so memory does not depend on the dataset size.
+    sample_weight follows add_sample_weight in weighted_splits and is 1 elsewhere.
+    """
+    dataset = pads.dataset(dataset_path, format='parquet')
+    to_drop, categorical, weighted_splits = list(to_drop), list(categorical), list(weighted_splits)
+
+    if splits is None:
+        splits = split_dates(dataset.to_table(columns=['valid_date']).column('valid_date').unique().to_pylist())
+    splits = {name: sorted(dates) for name, dates in splits.items()}
+
+    features = [x for x in dataset.schema.names if x not in to_drop + [LABEL, WEIGHT]]
+    columns = features + [LABEL, WEIGHT]
+    label_inputs = ['rh', 'is_freq', 'is_trip_ended']  # of target_fn and add_sample_weight
+    read_columns = features + [x for x in label_inputs if x not in features]
+
+    vocabularies = {}
+    for name in [x for x in categorical if x in features]:
+        values = dataset.to_table(columns=[name]).column(name).unique().to_pandas().astype(str)
+        vocabularies[name] = sorted(values.unique().tolist())
+
+    schema = {
+        'features': features,
+        'columns': columns,
+        'label': LABEL,
+        'weight': WEIGHT,
+        'vocabularies': vocabularies,
+        'record_bytes': 4 * len(columns),
+        'splits': {}
+    }
+
+    for name, dates in splits.items():
+        writer = _ShardWriter(os.path.join(output_path, name), rows_per_shard)
+        batches = dataset.to_batches(
+            columns=read_columns, filter=pads.field('valid_date').isin(dates), batch_size=batch_size
+        )
+        try:
+            for batch in tqdm(batches, desc=f'Writing {name} shards...'):
+                frame = target_fn(batch.to_pandas())
+                if name in weighted_splits:
+                    frame = add_sample_weight(frame)
+                else:
+                    frame[WEIGHT] = 1.0
+                writer.write(_to_records(frame, columns, vocabularies))
+        finally:
+            writer.close()
+
+        schema['splits'][name] = {'dates': [str(x) for x in dates], 'rows': writer.rows, 'shards': writer.shards}
+        print(f'{name}: {writer.rows} rows in {len(writer.shards)} shards')
+
+    with open(os.path.join(output_path, SCHEMA_FILE), 'w') as f:
+        json.dump(schema, f, indent=2)
+
+    return schema
+
+
+def read_schema(path: str) -> dict:
+    with open(os.path.join(path, SCHEMA_FILE)) as f:
+        return json.load(f)
+
+
+def read_records(path: str, split: str) -> np.ndarray:
+    """All records of a split as one (rows, columns) float32 matrix, e.g. for scoring without TensorFlow"""
+    schema = read_schema(path)
+    info = schema['splits'][split]
+    records = np.empty((info['rows'], len(schema['columns'])), dtype=np.float32)
+    start = 0
+    for shard in info['shards']:
+        block = np.fromfile(os.path.join(path, split, shard), dtype='<f4').reshape(-1, len(schema['columns']))
+        records[start:start + len(block)] = block
+        start += len(block)
+    return records
+
+
+def shard_dataset(
+        path: str,
+        split: str,
+        batch_size: int = 4096,
+        shuffle_buffer: int = 0,
+        seed: Optional[int] = None,
+        with_label: bool = True
+):
+    """
+    tf.data pipeline over the shards of a split, same elements as
+    tfdf.keras.pd_dataframe_to_tf_dataset(..., label='target', weight='sample_weight'):
+    (features dict, label, sample_weight), or the features dict alone if not with_label.
+
+    Shards are read in parallel, records are decoded per batch in parallel and prefetched.
+    """
+    import tensorflow as tf
+
+    schema = read_schema(path)
+    files = [os.path.join(path, split, x) for x in schema['splits'][split]['shards']]
+    num_columns = len(schema['columns'])
+    vocabularies = {name: tf.constant(values) for name, values in schema['vocabularies'].items()}
+
+    def decode(records):
+        values = tf.reshape(tf.io.decode_raw(records, tf.float32, little_endian=True), [-1, num_columns])
+        features = {}
+        for i, name in enumerate(schema['features']):
+            if name in vocabularies:
+                features[name] = tf.gather(vocabularies[name], tf.cast(values[:, i], tf.int32))
+            else:
+                features[name] = values[:, i]
+
+        if not with_label:
+            return features
+        return features, tf.cast(values[:, num_columns - 2], tf.int64), values[:, num_columns - 1]
+
+    dataset = tf.data.FixedLengthRecordDataset(
+        files, record_bytes=schema['record_bytes'], num_parallel_reads=tf.data.AUTOTUNE
+    )
+    if shuffle_buffer:
+        dataset = dataset.shuffle(shuffle_buffer, seed=seed)
+
+    return dataset.batch(batch_size) \
+        .map(decode, num_parallel_calls=tf.data.AUTOTUNE) \
+        .prefetch(tf.data.AUTOTUNE)
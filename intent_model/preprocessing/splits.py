@@ -0,0 +1,88 @@
+import glob
+import polars as pl
+import pandas as pd
+import pyarrow.dataset as pads
+
+from typing import Dict, Iterable, List, Optional, Sequence
+
+try:
+    from ._utils import TO_DROP, CAT, LABEL, WEIGHT
+    from .shards import split_dates, SPLIT_NAMES
+    from .targets import sample_weight_expr, rh_vs_rest_target_expr
+except ImportError:
+    from _utils import TO_DROP, CAT, LABEL, WEIGHT
+    from shards import split_dates, SPLIT_NAMES
+    from targets import sample_weight_expr, rh_vs_rest_target_expr
+
+
+def split_dates_by_boundaries(
+        dates: Iterable,
+        boundaries: Sequence[str],
+        names: Sequence[str] = SPLIT_NAMES
+) -> Dict[str, List]:
+    """names[i] gets the dates in [boundaries[i - 1], boundaries[i]) (ISO strings), the last name the rest"""
+    assert len(names) == len(boundaries) + 1, 'One more name than boundaries is needed'
+    dates = sorted(set(dates))
+    result = {name: [] for name in names}
+    for date in dates:
+        result[names[sum(str(date) >= str(b) for b in boundaries)]].append(date)
+    return result
+
+
+def scan_splits(
+        path: str,
+        counts: Sequence[int] = (60, 15),
+        boundaries: Optional[Sequence[str]] = None,
+        names: Sequence[str] = SPLIT_NAMES,
+        to_drop: Iterable[str] = TO_DROP,
+        categorical: Iterable[str] = CAT,
+        keep: Iterable[str] = (),
+        weighted_splits: Iterable[str] = ('train',),
+        target: Optional[pl.Expr] = None
+) -> Dict[str, pl.LazyFrame]:
+    """
+    Lazy train/val/test frames of the dataset parquet file(s) at path (file, directory or glob),
+    split over the sorted valid_dates by counts (60/15/rest by default) or by date boundaries.
+
+    Each split filters on its valid_dates and selects only the model columns (everything but
+    to_drop, plus keep, e.g. ('rh', 'is_freq') for evaluation) with the label and sample_weight.
+    The scan goes through pyarrow.dataset, which gets the filter and the columns: it reads just those
+    columns and skips row groups whose valid_date statistics are outside the split (polars' own
+    parquet reader does not prune on the statistics of string columns). Categorical columns
+    are cast to str as in training. The dataset has no label: target is a targets expression
+    (rh_vs_rest_target_expr() by default) built from the source columns in the scan.
+    sample_weight follows add_sample_weight in weighted_splits, 1 elsewhere.
+    """
+    sources = sorted(glob.glob(path)) if glob.has_magic(path) else path
+    scan = pl.scan_pyarrow_dataset(pads.dataset(sources, format='parquet'))
+    dates = scan.select('valid_date').unique().collect()['valid_date'].to_list()
+    if boundaries is not None:
+        splits = split_dates_by_boundaries(dates, boundaries, names)
+    else:
+        splits = split_dates(dates, counts, names)
+
+    drop = set(to_drop) - set(keep)
+    columns = [x for x in scan.columns if x not in drop and x not in (LABEL, WEIGHT)]
+    target = rh_vs_rest_target_expr() if target is None else target.alias(LABEL)
+    cat = [x for x in categorical if x in columns]
+    # source columns of the label and sample_weight expressions
+    read_columns = list(dict.fromkeys(columns + ['rh', 'is_freq', 'is_trip_ended'] + target.meta.root_names()))
+
+    frames = {}
+    for name, split in splits.items():
+        # is_in is pushed down to pyarrow as a filter; polars 0.19 reads str bounds of is_between as columns
+        frame = scan.filter(pl.col('valid_date').is_in(list(split)))
+        weight = sample_weight_expr() if name in weighted_splits else pl.lit(1.0).alias(WEIGHT)
+        # filter and columns go to pyarrow; the expressions run above a barrier, polars 0.19 projection
+        # pushdown into pyarrow scans breaks on them (panics on when/then, loses fill_null inputs)
+        frames[name] = frame.select(read_columns) \
+            .map_batches(lambda x: x, predicate_pushdown=False, projection_pushdown=False, streamable=False) \
+            .select(columns + [target, weight]) \
+            .with_columns([pl.col(x).cast(pl.Utf8) for x in cat])
+    return frames
+
+
+def load_splits(path: str, **kwargs) -> Dict[str, pd.DataFrame]:
+    """scan_splits collected into pandas one split at a time (drop keep columns before training)"""
+    return {name: frame.collect().to_pandas() for name, frame in scan_splits(path, **kwargs).items()}
+
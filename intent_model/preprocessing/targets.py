@@ -1,4 +1,5 @@
 import pandas as pd
+import polars as pl
 
 
 def multiclass_target(data: pd.DataFrame) -> pd.DataFrame:
@@ -18,3 +19,35 @@ def pattern_vs_rest_target(data:pd.DataFrame) -> pd.DataFrame:
     """binary"""
     data['target'] = data['is_freq'].astype(int)
     return data
+
+
+def multiclass_target_expr() -> pl.Expr:
+    """multiclass_target as a polars expression, for lazy reads"""
+    return (pl.col('is_freq').fill_null(0) + pl.col('rh')).cast(pl.Int64).alias('target')
+
+
+def rh_vs_rest_target_expr() -> pl.Expr:
+    """rh_vs_rest_target as a polars expression, for lazy reads"""
+    return pl.col('rh').cast(pl.Int64).alias('target')
+
+
+def pattern_vs_rest_target_expr() -> pl.Expr:
+    """pattern_vs_rest_target as a polars expression, for lazy reads"""
+    return pl.col('is_freq').cast(pl.Int64).alias('target')
+
+
+def add_sample_weight(data: pd.DataFrame) -> pd.DataFrame:
+    """RH sessions without a frequent location weigh 0.75, RH sessions without an ended trip 0.5"""
+    data['sample_weight'] = 1.0
+    data.loc[(data['rh'] == 1) & (data['is_freq'] == 0), 'sample_weight'] = 0.75
+    data.loc[(data['rh'] == 1) & (data['is_trip_ended'] == 0), 'sample_weight'] = 0.5
+    return data
+
+
+def sample_weight_expr() -> pl.Expr:
+    """add_sample_weight as a polars expression, for lazy reads"""
+    rh = pl.col('rh') == 1
+    return pl.when(rh & (pl.col('is_trip_ended') == 0)).then(0.5) \
+        .when(rh & (pl.col('is_freq') == 0)).then(0.75) \
+        .otherwise(1.0) \
+        .alias('sample_weight')
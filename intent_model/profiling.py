@@ -0,0 +1,199 @@
+import os
+import json
+import time
+import resource
+import pandas as pd
+
+from typing import Any, Callable, List, Optional, Tuple
+
+_STATUS = '/proc/self/status'
+_CLEAR_REFS = '/proc/self/clear_refs'
+
+
+def _rss_mb() -> Tuple[float, float]:
+    """(current, peak since the last reset) RSS in MB; peak is the process peak where /proc is not available"""
+    try:
+        with open(_STATUS) as f:
+            status = dict(line.split(':', 1) for line in f if line.startswith(('VmRSS', 'VmHWM')))
+        return int(status['VmRSS'].split()[0]) / 1024, int(status['VmHWM'].split()[0]) / 1024
+    except (OSError, KeyError, ValueError):
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        return peak, peak
+
+
+def _reset_peak() -> bool:
+    """Resets the peak RSS (VmHWM) of the process, Linux only"""
+    try:
+        with open(_CLEAR_REFS, 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def _length(value: Any) -> Optional[int]:
+    if isinstance(value, (str, bytes)):
+        return None  # e.g. a path
+    try:
+        return len(value)
+    except TypeError:
+        return None
+
+
+class _Stage(object):
+    """Record of one stage run, set rows_out (or any extra field) inside the with block"""
+    def __init__(self, profiler: 'StageProfiler', name: str, rows_in: Optional[int], context: dict):
+        self.profiler = profiler
+        self.name = name
+        self.rows_in = rows_in
+        self.rows_out = None
+        self.context = context
+        self.peak = 0.0
+        self.start_peak = 0.0
+
+    def __enter__(self) -> '_Stage':
+        self.profiler._enter(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.seconds = time.perf_counter() - self.start
+        self.profiler._exit(self, failed=exc[0] is not None)
+
+
+class _NullStage(object):
+    """Shared no-op stage: attribute writes are accepted and dropped"""
+    def __enter__(self) -> '_NullStage':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        pass
+
+    def __setattr__(self, key: str, value: Any) -> None:
+        pass
+
+
+_NULL_STAGE = _NullStage()
+
+
+class StageProfiler(object):
+    """
+    Wall time, rows in/out and RSS of pipeline stages, e.g. per day:
+
+        with profiler.stage('clean_sessions', day=date, rows_in=len(sessions)) as s:
+            sessions = clean_sessions(sessions)
+            s.rows_out = len(sessions)
+
+    or profiler.call('clean_sessions', clean_sessions, sessions, day=date), which counts rows of the
+    first argument and of the result. Stages nest; every record has its parent stage.
+
+    peak_rss_mb is the process peak RSS at the end of the stage and peak_delta_mb its growth over the
+    peak at the stage start, i.e. how far the stage pushed the process peak (0 if it stayed below it).
+    With reset_peak (Linux only), the kernel high-water mark of the whole process is reset at each
+    stage start, so peak_rss_mb is the true peak within the stage (carried over to enclosing stages)
+    and peak_delta_mb its growth over the RSS at the start. This is off by default: it also changes
+    the peak seen by anything else in the process, e.g. resource.getrusage or an outer profiler.
+    Records are kept in memory and appended to path as JSON lines when it is set.
+    """
+    enabled = True
+
+    def __init__(self, path: Optional[str] = None, reset_peak: bool = False):
+        self.path = path
+        self.records = []
+        self._stack = []
+        self._resettable = reset_peak and _reset_peak()
+        if path is not None and os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    def stage(self, name: str, rows_in: Optional[int] = None, **context) -> _Stage:
+        return _Stage(self, name, rows_in, context)
+
+    def call(self, name: str, function: Callable, *args, **context) -> Any:
+        """function(*args) as a stage, rows counted with len() of args[0] and of the result"""
+        with self.stage(name, rows_in=_length(args[0]) if args else None, **context) as s:
+            result = function(*args)
+            s.rows_out = _length(result)
+        return result
+
+    def _update_peaks(self) -> float:
+        _, peak = _rss_mb()
+        for stage in self._stack:
+            stage.peak = max(stage.peak, peak)
+        return peak
+
+    def _enter(self, stage: _Stage) -> None:
+        if self._resettable:
+            # the high-water mark so far belongs to the enclosing stages
+            self._update_peaks()
+            _reset_peak()
+        _, stage.start_peak = _rss_mb()
+        self._stack.append(stage)
+
+    def _exit(self, stage: _Stage, failed: bool) -> None:
+        self._update_peaks()
+        self._stack.pop()
+        rss, _ = _rss_mb()
+        record = {
+            'stage': stage.name,
+            'parent': self._stack[-1].name if self._stack else None,
+            **{k: v if isinstance(v, (int, float, bool)) or v is None else str(v) for k, v in stage.context.items()},
+            'seconds': round(stage.seconds, 6),
+            'rows_in': stage.rows_in,
+            'rows_out': stage.rows_out,
+            'rss_mb': round(rss, 1),
+            'peak_rss_mb': round(stage.peak, 1),
+            'peak_delta_mb': round(stage.peak - stage.start_peak, 1),
+            'failed': failed
+        }
+        self.records.append(record)
+        if self.path is not None:
+            with open(self.path, 'a') as f:
+                f.write(json.dumps(record) + '\n')
+
+    def to_frame(self) -> pd.DataFrame:
+        return pd.DataFrame(self.records)
+
+    def summary(self) -> pd.DataFrame:
+        """Per stage: calls, total and mean seconds, share of the top-level time, rows, max peak RSS and growth"""
+        frame = self.to_frame()
+        if frame.empty:
+            return frame
+        total = frame.loc[frame['parent'].isna(), 'seconds'].sum()
+        summary = frame.groupby('stage', sort=False).agg(
+            calls=('seconds', 'size'),
+            seconds=('seconds', 'sum'),
+            mean_seconds=('seconds', 'mean'),
+            rows_in=('rows_in', 'sum'),
+            rows_out=('rows_out', 'sum'),
+            peak_rss_mb=('peak_rss_mb', 'max'),
+            peak_delta_mb=('peak_delta_mb', 'max')
+        )
+        summary['share'] = summary['seconds'] / total if total > 0 else float('nan')
+        return summary.sort_values('seconds', ascending=False)
+
+    def print_summary(self) -> None:
+        print(self.summary().to_string(float_format=lambda x: f'{x:.3f}'))
+
+
+class NullProfiler(StageProfiler):
+    """Disabled profiler: stages are one shared no-op object, calls go straight to the function"""
+    enabled = False
+
+    def __init__(self):
+        self.path = None
+        self.records = []
+
+    def stage(self, name: str, rows_in: Optional[int] = None, **context) -> _NullStage:
+        return _NULL_STAGE
+
+    def call(self, name: str, function: Callable, *args, **context) -> Any:
+        return function(*args)
+
+
+NULL_PROFILER = NullProfiler()
+
+
+def read_records(path: str) -> List[dict]:
+    """Records of a JSON lines file written by StageProfiler"""
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
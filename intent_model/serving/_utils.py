@@ -0,0 +1,2 @@
+MIN_LOCATION_BOOKINGS = 3  # a location is "known" after 3 distinct bookings (see get_rh_features)
+MIN_FREQ_LOCATIONS = 2  # customers need at least 2 known locations to get features
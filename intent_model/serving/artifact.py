@@ -0,0 +1,135 @@
+import json
+import numpy as np
+import pandas as pd
+
+from typing import Any, Optional, Tuple, Union
+from numba import jit, prange
+
+try:
+    from .forest import CompiledForest, _row_margin
+    from .calibrator import Calibrator
+except ImportError:
+    from forest import CompiledForest, _row_margin
+    from calibrator import Calibrator
+
+
+@jit(nopython=True, nogil=True, cache=True)
+def _interp(x_knots: np.ndarray, y_knots: np.ndarray, t: float) -> float:
+    # same as TFIsotonicRegression.call: clip to fitted range, then linear interpolation
+    n = x_knots.shape[0]
+    if n == 1:
+        return y_knots[0]
+    t = min(max(t, x_knots[0]), x_knots[n - 1])
+    i = min(max(np.searchsorted(x_knots, t, side='right') - 1, 0), n - 2)
+    slope = (y_knots[i + 1] - y_knots[i]) / (x_knots[i + 1] - x_knots[i])
+    return y_knots[i] + slope * (t - x_knots[i])
+
+
+@jit(nopython=True, parallel=True, nogil=True, cache=True)
+def _score(
+        X: np.ndarray,
+        roots: np.ndarray,
+        kind: np.ndarray,
+        feature: np.ndarray,
+        threshold: np.ndarray,
+        cat_mask: np.ndarray,
+        missing_pos: np.ndarray,
+        pos_child: np.ndarray,
+        neg_child: np.ndarray,
+        value: np.ndarray,
+        bias: float,
+        sigmoid: bool,
+        x_knots: np.ndarray,
+        y_knots: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray]:
+    raw = np.empty(X.shape[0], dtype=np.float32)
+    calibrated = np.empty(X.shape[0], dtype=np.float32)
+
+    for i in prange(X.shape[0]):
+        margin = _row_margin(
+            X, i, roots, kind, feature, threshold, cat_mask, missing_pos, pos_child, neg_child, value, bias
+        )
+        score = np.float32(1.0 / (1.0 + np.exp(-margin)) if sigmoid else margin)
+        raw[i] = score
+        calibrated[i] = _interp(x_knots, y_knots, score)
+
+    return raw, calibrated
+
+
+class ScoringArtifact(object):
+    """
+    GBT scorer and isotonic calibration in one file and one compiled call.
+    Replaces loading models/tfdf_focal_latest and models/isotonic separately and running
+    model.predict followed by iso.predict.
+    """
+    def __init__(self, forest: CompiledForest, x_knots: np.ndarray, y_knots: np.ndarray):
+        assert len(x_knots) == len(y_knots) and len(x_knots) > 0, 'Calibration knots are empty or misaligned'
+        self.forest = forest
+        self.x_knots = np.ascontiguousarray(x_knots, dtype=np.float32)
+        self.y_knots = np.ascontiguousarray(y_knots, dtype=np.float32)
+
+    @classmethod
+    def from_models(
+            cls,
+            model: Any,
+            iso: Any,
+            max_knots: Optional[int] = None,
+            max_error: Optional[float] = None
+    ) -> 'ScoringArtifact':
+        """
+        model: trained tfdf GradientBoostedTreesModel (or CompiledForest),
+        iso: fitted TFIsotonicRegression/NPIsotonicRegression (or Calibrator), knots thinned as Calibrator.thin
+        """
+        forest = model if isinstance(model, CompiledForest) else CompiledForest.from_tfdf(model)
+        calibrator = iso if isinstance(iso, Calibrator) else Calibrator.from_model(iso)
+        calibrator = calibrator.thin(max_knots, max_error)
+        return cls(forest, calibrator.x_knots, calibrator.y_knots)
+
+    def save(self, path: str) -> None:
+        np.savez(
+            path,
+            meta=np.array(json.dumps(self.forest.meta)),
+            x_knots=self.x_knots,
+            y_knots=self.y_knots,
+            **self.forest.arrays
+        )
+
+    @classmethod
+    def load(cls, path: str) -> 'ScoringArtifact':
+        with np.load(path, allow_pickle=False) as f:
+            forest = CompiledForest(CompiledForest.read_arrays(f), **json.loads(str(f['meta'])))
+            return cls(forest, f['x_knots'], f['y_knots'])
+
+    @property
+    def feature_names(self):
+        return self.forest.feature_names
+
+    def score(self, X: Union[np.ndarray, pd.DataFrame]) -> Tuple[np.ndarray, np.ndarray]:
+        """Returns (raw, calibrated) scores"""
+        if isinstance(X, pd.DataFrame):
+            X = self.forest.encode(X)
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        assert X.ndim == 2 and X.shape[1] == len(self.feature_names), \
+            f'Expected a matrix with {len(self.feature_names)} features'
+        return _score(
+            X, *self.forest.kernel_args(), self.forest.activation == 'sigmoid', self.x_knots, self.y_knots
+        )
+
+    def predict(self, X: Union[np.ndarray, pd.DataFrame], verbose: int = 0) -> np.ndarray:
+        """Calibrated scores; drop-in for IsoModelWrapper.predict"""
+        return self.score(X)[1]
+
+    def __repr__(self) -> str:
+        return f'ScoringArtifact(forest={self.forest}, num_knots={len(self.x_knots)})'
+
+
+def export_artifact(
+        model: Any,
+        iso: Any,
+        path: str,
+        max_knots: Optional[int] = None,
+        max_error: Optional[float] = None
+) -> ScoringArtifact:
+    artifact = ScoringArtifact.from_models(model, iso, max_knots, max_error)
+    artifact.save(path)
+    return artifact
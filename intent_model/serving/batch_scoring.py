@@ -0,0 +1,189 @@
+import os
+import queue
+import argparse
+import threading
+import numpy as np
+import polars as pl
+
+from typing import Callable, Iterator, Optional, Tuple
+from tqdm import tqdm
+
+try:
+    from .artifact import ScoringArtifact
+    from ..preprocessing.preprocess import iter_days
+except ImportError:
+    from artifact import ScoringArtifact
+    from preprocessing.preprocess import iter_days
+
+ID_COLUMNS = ['sessionuuid', 'customer_id', 'ts']
+_DONE = object()
+
+
+def _stage(
+        target: Callable[[object], Optional[object]],
+        inbox: Optional[queue.Queue],
+        outbox: queue.Queue,
+        errors: list
+) -> threading.Thread:
+    """Runs target on every item of inbox (or over the iterator it returns) and forwards results"""
+    def run():
+        try:
+            if inbox is None:
+                for item in target(None):
+                    if errors:
+                        break
+                    outbox.put(item)
+            else:
+                while True:
+                    item = inbox.get()
+                    if item is _DONE:
+                        break
+                    if errors:
+                        continue  # keep draining so the upstream stage is not blocked
+                    result = target(item)
+                    if result is not None:
+                        outbox.put(result)
+        except Exception as e:
+            errors.append(e)
+            while inbox is not None and inbox.get() is not _DONE:
+                pass
+        finally:
+            outbox.put(_DONE)
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    return thread
+
+
+def score_frame(
+        frame: pl.DataFrame,
+        artifact: ScoringArtifact,
+        threshold: float,
+        chunk_size: int = 100000
+) -> pl.DataFrame:
+    X = artifact.forest.encode(frame.select(artifact.feature_names).to_pandas())
+    raw, calibrated = [], []
+
+    for start in range(0, len(X), chunk_size):
+        r, c = artifact.score(X[start:start + chunk_size])
+        raw.append(r)
+        calibrated.append(c)
+
+    calibrated = np.concatenate(calibrated) if calibrated else np.array([], dtype=np.float32)
+    return frame.select(ID_COLUMNS).with_columns([
+        pl.Series('score', np.concatenate(raw) if raw else np.array([], dtype=np.float32)),
+        pl.Series('calibrated_score', calibrated),
+        pl.Series('decision', (calibrated > threshold).astype(np.int8))
+    ])
+
+
+def score_days(
+        path: str,
+        artifact_path: str,
+        output_path: str,
+        threshold: float,
+        min_index: int = None,
+        max_index: int = None,
+        chunk_size: int = 100000,
+        queue_size: int = 2,
+        overwrite: bool = False,
+        drift_grid: Optional[str] = None
+) -> int:
+    """
+    Scores daily session/feature files from path (PrestoLoader layout) and writes one
+    parquet per day to output_path with ID_COLUMNS, score, calibrated_score and decision
+    (calibrated_score > threshold).
+
+    Reading + feature processing, scoring and writing run as separate stages connected by
+    queues of queue_size days, so at most a few days are held in memory at once.
+    Scoring runs on the calling thread, reading and writing in background threads.
+    Days already present in output_path are skipped unless overwrite is set.
+    Sessions are deduplicated day by day (see iter_days): a session in several daily files is
+    scored once, with its row of the first day read. The batch path (read_data) dedups over all days
+    and may keep a later row instead, so scores of such sessions can differ between the two.
+    With drift_grid (see drift.save_grid), the reading stage also writes the day's feature sketch
+    to path/sketches for DriftMonitor.
+    Returns the number of days written.
+    """
+    artifact = ScoringArtifact.load(artifact_path)
+    os.makedirs(output_path, exist_ok=True)
+
+    done = [] if overwrite else [x.replace('.pq', '') for x in os.listdir(output_path) if '.pq' in x]
+
+    grid = None
+    if drift_grid is not None:
+        try:
+            from ..drift import load_grid, write_sketches
+        except ImportError:
+            from drift import load_grid, write_sketches
+        grid = load_grid(drift_grid)
+
+    def read(_) -> Iterator[Tuple[str, pl.DataFrame]]:
+        days = iter_days(path, min_index=min_index, max_index=max_index, melt_dicts=True, skip_dates=done)
+        for date, frame in days:
+            if grid is not None:
+                write_sketches(frame, grid, path, date=date)
+            yield date, frame
+
+    written = []
+
+    def write(item: Tuple[str, pl.DataFrame]) -> None:
+        date, scores = item
+        scores.write_parquet(os.path.join(output_path, f'{date}.pq'))
+        written.append(date)
+
+    errors = []
+    features_queue, scores_queue = queue.Queue(maxsize=queue_size), queue.Queue(maxsize=queue_size)
+    threads = [
+        _stage(read, None, features_queue, errors),
+        _stage(write, scores_queue, queue.Queue(), errors)
+    ]
+
+    # scoring stays on the main thread: the numba kernel is parallel by itself
+    with tqdm(desc='Scoring days...') as bar:
+        for date, frame in iter(features_queue.get, _DONE):
+            if not errors:
+                try:
+                    scores_queue.put((date, score_frame(frame, artifact, threshold, chunk_size)))
+                except Exception as e:
+                    errors.append(e)
+            bar.set_postfix_str(date)
+            bar.update(1)
+        scores_queue.put(_DONE)
+
+    for thread in threads:
+        thread.join()
+
+    if errors:
+        raise errors[0]
+
+    print(f'{len(written)} days written to {output_path}')
+    return len(written)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Batch scoring of daily session/feature files')
+    parser.add_argument('--path', required=True, help='directory with features/ and sessions/')
+    parser.add_argument('--artifact', required=True, help='ScoringArtifact .npz')
+    parser.add_argument('--output', required=True, help='directory for scored parquet files')
+    parser.add_argument('--threshold', type=float, required=True, help='decision threshold on calibrated score')
+    parser.add_argument('--min-index', type=int, default=None)
+    parser.add_argument('--max-index', type=int, default=None)
+    parser.add_argument('--chunk-size', type=int, default=100000)
+    parser.add_argument('--queue-size', type=int, default=2)
+    parser.add_argument('--overwrite', action='store_true')
+    parser.add_argument('--drift-grid', default=None, help='grid JSON to write daily feature sketches with')
+    args = parser.parse_args()
+
+    score_days(
+        path=args.path,
+        artifact_path=args.artifact,
+        output_path=args.output,
+        threshold=args.threshold,
+        min_index=args.min_index,
+        max_index=args.max_index,
+        chunk_size=args.chunk_size,
+        queue_size=args.queue_size,
+        overwrite=args.overwrite,
+        drift_grid=args.drift_grid
+    )
@@ -0,0 +1,177 @@
+import asyncio
+import time
+import numpy as np
+
+from concurrent.futures import Executor, ThreadPoolExecutor
+from typing import Any, Callable, List, Optional, Tuple
+
+
+class BatcherMetrics(object):
+    def __init__(self, max_batch_size: int):
+        self.max_batch_size = max_batch_size
+        self.requests = 0
+        self.batches = 0
+        self.rows = 0
+        self.size_flushes = 0
+        self.deadline_flushes = 0
+        self.errors = 0
+        self.queue_depth = 0
+        self.max_queue_depth = 0
+        self.in_flight = 0
+        self.predict_seconds = 0.0
+
+    def observe_queue(self, depth: int) -> None:
+        self.queue_depth = depth
+        self.max_queue_depth = max(self.max_queue_depth, depth)
+
+    def observe_batch(self, size: int, by_size: bool, seconds: float) -> None:
+        self.batches += 1
+        self.rows += size
+        self.predict_seconds += seconds
+        if by_size:
+            self.size_flushes += 1
+        else:
+            self.deadline_flushes += 1
+
+    def snapshot(self) -> dict:
+        return {
+            'requests': self.requests,
+            'batches': self.batches,
+            'rows': self.rows,
+            'size_flushes': self.size_flushes,
+            'deadline_flushes': self.deadline_flushes,
+            'errors': self.errors,
+            'queue_depth': self.queue_depth,
+            'max_queue_depth': self.max_queue_depth,
+            'in_flight': self.in_flight,
+            'mean_batch_size': self.rows / self.batches if self.batches else 0.0,
+            'mean_batch_fill': self.rows / (self.batches * self.max_batch_size) if self.batches else 0.0,
+            'mean_predict_ms': 1000 * self.predict_seconds / self.batches if self.batches else 0.0
+        }
+
+
+class MicroBatcher(object):
+    """
+    Collects single feature vectors into micro-batches for a batch scorer.
+
+    A batch is flushed when it reaches max_batch_size or when max_wait_ms passed since its first
+    request. Up to max_concurrency batches are scored at once in worker threads, so the event loop
+    keeps accepting requests meanwhile.
+
+    predict takes a (n, n_features) float32 matrix and returns an array of n scores or a tuple of
+    such arrays, e.g. ScoringArtifact.score, which gives (raw, calibrated) per request.
+    Any callable works, so a dummy model is enough to test it.
+    """
+    def __init__(
+            self,
+            predict: Callable[[np.ndarray], Any],
+            max_batch_size: int = 4096,
+            max_wait_ms: float = 5.0,
+            max_concurrency: int = 2,
+            executor: Optional[Executor] = None
+    ):
+        assert max_batch_size > 0 and max_concurrency > 0, 'max_batch_size and max_concurrency must be positive'
+        self.predict = predict
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.max_concurrency = max_concurrency
+        self.executor = executor
+        self.metrics = BatcherMetrics(max_batch_size)
+        self._own_executor = executor is None
+        self._queue: Optional[asyncio.Queue] = None
+        self._collector: Optional[asyncio.Task] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._dispatches = set()
+
+    async def start(self) -> 'MicroBatcher':
+        if self._collector is None:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(max_workers=self.max_concurrency)
+            self._queue = asyncio.Queue()
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+            self._collector = asyncio.get_running_loop().create_task(self._collect())
+        return self
+
+    async def stop(self) -> None:
+        """Scores what is already queued, then stops"""
+        if self._collector is None:
+            return
+        await self._queue.join()
+        self._collector.cancel()
+        try:
+            await self._collector
+        except asyncio.CancelledError:
+            pass
+        if self._dispatches:
+            await asyncio.gather(*self._dispatches, return_exceptions=True)
+        if self._own_executor:
+            self.executor.shutdown(wait=True)
+            self.executor = None
+        self._collector = None
+
+    async def __aenter__(self) -> 'MicroBatcher':
+        return await self.start()
+
+    async def __aexit__(self, *args) -> None:
+        await self.stop()
+
+    async def score(self, features: np.ndarray) -> Any:
+        """Scores one feature vector; resolves once its batch is scored"""
+        assert self._collector is not None, 'MicroBatcher is not started'
+        future = asyncio.get_running_loop().create_future()
+        self.metrics.requests += 1
+        self._queue.put_nowait((np.asarray(features, dtype=np.float32), future))
+        self.metrics.observe_queue(self._queue.qsize())
+        return await future
+
+    async def _next_batch(self) -> Tuple[List[Tuple[np.ndarray, asyncio.Future]], bool]:
+        loop = asyncio.get_running_loop()
+        batch = [await self._queue.get()]
+        deadline = loop.time() + self.max_wait
+
+        while len(batch) < self.max_batch_size:
+            if not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+                continue
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout=remaining))
+            except asyncio.TimeoutError:
+                break
+
+        self.metrics.observe_queue(self._queue.qsize())
+        return batch, len(batch) >= self.max_batch_size
+
+    async def _collect(self) -> None:
+        while True:
+            batch, by_size = await self._next_batch()
+            await self._semaphore.acquire()
+            task = asyncio.get_running_loop().create_task(self._dispatch(batch, by_size))
+            self._dispatches.add(task)
+            task.add_done_callback(self._dispatches.discard)
+
+    async def _dispatch(self, batch: List[Tuple[np.ndarray, asyncio.Future]], by_size: bool) -> None:
+        self.metrics.in_flight += 1
+        start = time.perf_counter()
+        try:
+            X = np.stack([features for features, _ in batch])
+            result = await asyncio.get_running_loop().run_in_executor(self.executor, self.predict, X)
+        except Exception as e:
+            self.metrics.errors += 1
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+        else:
+            self.metrics.observe_batch(len(batch), by_size, time.perf_counter() - start)
+            for i, (_, future) in enumerate(batch):
+                if not future.done():
+                    future.set_result(
+                        tuple(r[i] for r in result) if isinstance(result, tuple) else result[i]
+                    )
+        finally:
+            self.metrics.in_flight -= 1
+            for _ in batch:
+                self._queue.task_done()
+            self._semaphore.release()
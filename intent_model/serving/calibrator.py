@@ -0,0 +1,125 @@
+import heapq
+import numpy as np
+
+from typing import Any, Optional, Tuple
+
+
+def _worst_knot(x: np.ndarray, y: np.ndarray, i: int, j: int) -> Tuple[float, int]:
+    """Largest deviation of the inner knots of [i, j] from the chord between knots i and j"""
+    inner = slice(i + 1, j)
+    t = (x[inner] - x[i]) / (x[j] - x[i])
+    error = np.abs(y[i] + t * (y[j] - y[i]) - y[inner])
+    k = int(np.argmax(error))
+    return float(error[k]), i + 1 + k
+
+
+def thin_knots(
+        x: np.ndarray,
+        y: np.ndarray,
+        max_knots: Optional[int] = None,
+        max_error: Optional[float] = None
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Subset of the knots whose interpolation stays within max_error of the original one, using at
+    most max_knots knots (whichever is reached first; without both only exactly redundant knots
+    are dropped). Knots are added greedily where the deviation is largest, starting from the two ends.
+
+    Both interpolations are piecewise linear with breaks at the original knots, so the deviation
+    measured at those knots is exact. Any subset of a monotone set of knots is monotone.
+    """
+    assert max_knots is None or max_knots >= 2, 'At least two knots are needed'
+    n = len(x)
+    if n <= 2:
+        return x, y
+    if max_knots is None and max_error is None:
+        max_error = 0.0
+
+    x64, y64 = np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64)
+    keep = [0, n - 1]
+    heap = []
+
+    def push(i: int, j: int) -> None:
+        if j - i > 1:
+            error, k = _worst_knot(x64, y64, i, j)
+            heapq.heappush(heap, (-error, k, i, j))
+
+    push(0, n - 1)
+    while heap:
+        error, k, i, j = heap[0]
+        if max_error is not None and -error <= max_error:
+            break
+        if max_knots is not None and len(keep) >= max_knots:
+            break
+        heapq.heappop(heap)
+        keep.append(k)
+        push(i, k)
+        push(k, j)
+
+    keep = np.sort(keep)
+    return x[keep], y[keep]
+
+
+class Calibrator(object):
+    """
+    Isotonic calibration as (x, y) interpolation knots, stored as one (2, num_knots) float32 .npy
+    file. Needs only numpy: no TensorFlow/Keras to load and no tracing on the first call.
+    Same mapping as TFIsotonicRegression.call: clip to [x_min, x_max], then linear interpolation.
+    """
+    def __init__(self, x_knots: np.ndarray, y_knots: np.ndarray):
+        assert len(x_knots) == len(y_knots) and len(x_knots) > 0, 'Calibration knots are empty or misaligned'
+        self.x_knots = np.ascontiguousarray(x_knots, dtype=np.float32)
+        self.y_knots = np.ascontiguousarray(y_knots, dtype=np.float32)
+
+    @classmethod
+    def from_model(cls, iso: Any) -> 'Calibrator':
+        """iso: fitted NPIsotonicRegression or TFIsotonicRegression, also one loaded from models/isotonic"""
+        if hasattr(iso, 'knots'):
+            x, y = iso.knots()
+        else:
+            assert hasattr(iso, 'X_thresholds_'), 'Calibration model is not fitted'
+            x, y = iso.X_thresholds_, iso.y_thresholds_
+        return cls(np.asarray(x), np.asarray(y))
+
+    def thin(self, max_knots: Optional[int] = None, max_error: Optional[float] = None) -> 'Calibrator':
+        return Calibrator(*thin_knots(self.x_knots, self.y_knots, max_knots, max_error))
+
+    def max_deviation(self, reference: 'Calibrator') -> float:
+        """Largest absolute difference to reference, e.g. the unthinned calibrator"""
+        return float(np.max(np.abs(self(reference.x_knots).astype(np.float64) - reference.y_knots)))
+
+    def save(self, path: str) -> None:
+        np.save(path, np.stack([self.x_knots, self.y_knots]))
+
+    @classmethod
+    def load(cls, path: str) -> 'Calibrator':
+        knots = np.load(path, allow_pickle=False)
+        return cls(knots[0], knots[1])
+
+    def __call__(self, scores: np.ndarray) -> np.ndarray:
+        scores = np.asarray(scores, dtype=np.float32).reshape(-1)
+        if len(self.x_knots) == 1:
+            return np.repeat(self.y_knots, len(scores))
+        return np.interp(scores, self.x_knots, self.y_knots).astype(np.float32)
+
+    def predict(self, scores: np.ndarray, verbose: int = 0) -> np.ndarray:
+        return self(scores)
+
+    def __len__(self) -> int:
+        return len(self.x_knots)
+
+    def __repr__(self) -> str:
+        return f'Calibrator(num_knots={len(self)})'
+
+
+def export_calibrator(
+        iso: Any,
+        path: str,
+        max_knots: Optional[int] = None,
+        max_error: Optional[float] = None
+) -> Calibrator:
+    """Saves the knots of a fitted isotonic model, thinned to max_knots / max_error, and prints the deviation"""
+    full = Calibrator.from_model(iso)
+    calibrator = full.thin(max_knots, max_error)
+    calibrator.save(path)
+    print(f'{len(full)} -> {len(calibrator)} knots, max deviation {calibrator.max_deviation(full):.2e}')
+    return calibrator
@@ -0,0 +1,314 @@
+import json
+import numpy as np
+import pandas as pd
+
+from typing import Any, Dict, List, Optional, Union
+from numba import jit, prange
+
+LEAF, NUMERICAL, CATEGORICAL = 0, 1, 2
+OOD_INDEX = 0  # TF-DF reserves index 0 of categorical dictionaries for out-of-dictionary values
+
+
+@jit(nopython=True, nogil=True, cache=True)
+def _row_margin(
+        X: np.ndarray,
+        i: int,
+        roots: np.ndarray,
+        kind: np.ndarray,
+        feature: np.ndarray,
+        threshold: np.ndarray,
+        cat_mask: np.ndarray,
+        missing_pos: np.ndarray,
+        pos_child: np.ndarray,
+        neg_child: np.ndarray,
+        value: np.ndarray,
+        bias: float
+) -> float:
+    acc = bias
+    for t in range(roots.shape[0]):
+        node = roots[t]
+        while kind[node] != LEAF:
+            x = X[i, feature[node]]
+            if np.isnan(x):
+                go_pos = missing_pos[node]
+            elif kind[node] == NUMERICAL:
+                go_pos = x >= threshold[node]
+            else:
+                c = np.uint64(x)
+                go_pos = c < 64 and ((cat_mask[node] >> c) & np.uint64(1)) == 1
+            node = pos_child[node] if go_pos else neg_child[node]
+        acc += value[node]
+    return acc
+
+
+@jit(nopython=True, parallel=True, nogil=True, cache=True)
+def _predict_margin(
+        X: np.ndarray,
+        roots: np.ndarray,
+        kind: np.ndarray,
+        feature: np.ndarray,
+        threshold: np.ndarray,
+        cat_mask: np.ndarray,
+        missing_pos: np.ndarray,
+        pos_child: np.ndarray,
+        neg_child: np.ndarray,
+        value: np.ndarray,
+        bias: float
+) -> np.ndarray:
+    out = np.empty(X.shape[0], dtype=np.float64)
+    for i in prange(X.shape[0]):
+        out[i] = _row_margin(
+            X, i, roots, kind, feature, threshold, cat_mask, missing_pos, pos_child, neg_child, value, bias
+        )
+    return out
+
+
+@jit(nopython=True, nogil=True, cache=True)
+def _node_counts(
+        X: np.ndarray,
+        roots: np.ndarray,
+        kind: np.ndarray,
+        feature: np.ndarray,
+        threshold: np.ndarray,
+        cat_mask: np.ndarray,
+        missing_pos: np.ndarray,
+        pos_child: np.ndarray,
+        neg_child: np.ndarray
+) -> np.ndarray:
+    counts = np.zeros(kind.shape[0], dtype=np.float64)
+    for i in range(X.shape[0]):
+        for t in range(roots.shape[0]):
+            node = roots[t]
+            counts[node] += 1
+            while kind[node] != LEAF:
+                x = X[i, feature[node]]
+                if np.isnan(x):
+                    go_pos = missing_pos[node]
+                elif kind[node] == NUMERICAL:
+                    go_pos = x >= threshold[node]
+                else:
+                    c = np.uint64(x)
+                    go_pos = c < 64 and ((cat_mask[node] >> c) & np.uint64(1)) == 1
+                node = pos_child[node] if go_pos else neg_child[node]
+                counts[node] += 1
+    return counts
+
+
+class CompiledForest(object):
+    """
+    Flat array representation of a TF-DF gradient boosted trees model.
+
+    Nodes of all trees are stored in one set of arrays: a node is either a leaf (value),
+    a numerical split (x >= threshold goes to pos_child) or a categorical split
+    (bit x of cat_mask set goes to pos_child). Missing values follow missing_pos.
+    Categorical features are fed as their TF-DF dictionary index, see encode().
+    Optional cover holds the number of training examples reaching each node (for TreeSHAP).
+    """
+    ARRAYS = ['roots', 'kind', 'feature', 'threshold', 'cat_mask', 'missing_pos', 'pos_child', 'neg_child', 'value']
+    OPTIONAL_ARRAYS = ['cover']
+
+    def __init__(
+            self,
+            arrays: Dict[str, np.ndarray],
+            feature_names: List[str],
+            vocabularies: Dict[str, List[str]],
+            bias: float = 0.0,
+            activation: str = 'sigmoid'
+    ):
+        self.roots = arrays['roots'].astype(np.int32)
+        self.kind = arrays['kind'].astype(np.int8)
+        self.feature = arrays['feature'].astype(np.int32)
+        self.threshold = arrays['threshold'].astype(np.float32)
+        self.cat_mask = arrays['cat_mask'].astype(np.uint64)
+        self.missing_pos = arrays['missing_pos'].astype(np.bool_)
+        self.pos_child = arrays['pos_child'].astype(np.int32)
+        self.neg_child = arrays['neg_child'].astype(np.int32)
+        self.value = arrays['value'].astype(np.float32)
+        self.cover = arrays['cover'].astype(np.float64) if arrays.get('cover') is not None else None
+        self.feature_names = list(feature_names)
+        self.vocabularies = {k: list(v) for k, v in vocabularies.items()}
+        self.bias = float(bias)
+        self.activation = activation
+
+    @property
+    def num_trees(self) -> int:
+        return len(self.roots)
+
+    @property
+    def num_nodes(self) -> int:
+        return len(self.kind)
+
+    @classmethod
+    def from_tfdf(cls, model: Any) -> 'CompiledForest':
+        """Converts a trained tfdf.keras.GradientBoostedTreesModel"""
+        import tensorflow_decision_forests as tfdf
+
+        inspector = model.make_inspector()
+        features = inspector.features()
+        feature_names = [f.name for f in features]
+        feature_index = {name: i for i, name in enumerate(feature_names)}
+
+        vocabularies = {}
+        for f in features:
+            column = inspector.dataspec.columns[f.col_idx]
+            if f.type == tfdf.py_tree.dataspec.ColumnType.CATEGORICAL and not column.categorical.is_already_integerized:
+                items = sorted(column.categorical.items.items(), key=lambda kv: kv[1].index)
+                vocabularies[f.name] = [k for k, _ in items]
+
+        nodes = {k: [] for k in cls.ARRAYS + cls.OPTIONAL_ARRAYS if k != 'roots'}
+        roots = []
+
+        def add_node(node) -> int:
+            idx = len(nodes['kind'])
+            for k in nodes.keys():
+                nodes[k].append(0)
+
+            if isinstance(node, tfdf.py_tree.node.LeafNode):
+                nodes['kind'][idx] = LEAF
+                nodes['value'][idx] = node.value.value
+                nodes['cover'][idx] = getattr(node.value, 'num_examples', None) or 0
+                return idx
+
+            condition = node.condition
+            nodes['feature'][idx] = feature_index[condition.feature.name]
+            nodes['missing_pos'][idx] = condition.missing_evaluation
+
+            if isinstance(condition, tfdf.py_tree.condition.NumericalHigherThanCondition):
+                nodes['kind'][idx] = NUMERICAL
+                nodes['threshold'][idx] = condition.threshold
+            elif isinstance(condition, tfdf.py_tree.condition.CategoricalIsInCondition):
+                vocab = vocabularies.get(condition.feature.name)
+                mask = 0
+                for item in condition.mask:
+                    index = vocab.index(item) if isinstance(item, str) else int(item)
+                    assert index < 64, 'Categorical dictionaries above 64 items are not supported'
+                    mask |= 1 << index
+                nodes['kind'][idx] = CATEGORICAL
+                nodes['cat_mask'][idx] = mask
+            elif isinstance(condition, tfdf.py_tree.condition.TrueValueCondition):
+                nodes['kind'][idx] = NUMERICAL
+                nodes['threshold'][idx] = 0.5
+            else:
+                raise NotImplementedError(f'Unsupported condition: {type(condition).__name__}')
+
+            nodes['pos_child'][idx] = add_node(node.pos_child)
+            nodes['neg_child'][idx] = add_node(node.neg_child)
+            nodes['cover'][idx] = nodes['cover'][nodes['pos_child'][idx]] + nodes['cover'][nodes['neg_child'][idx]]
+            return idx
+
+        for tree in inspector.iterate_on_trees():
+            roots.append(add_node(tree.root))
+
+        header = inspector.specialized_header()
+        assert len(header.initial_predictions) == 1, 'Only binary classification and regression are supported'
+        activation = 'sigmoid' if inspector.task == tfdf.keras.Task.CLASSIFICATION else 'identity'
+
+        arrays = {k: np.array(v) for k, v in nodes.items()}
+        arrays['cat_mask'] = np.array(nodes['cat_mask'], dtype=np.uint64)
+        arrays['roots'] = np.array(roots)
+        if not np.all(arrays['cover'][arrays['roots']] > 0):
+            arrays['cover'] = None  # no example counts in the model, see compute_cover
+        return cls(arrays, feature_names, vocabularies, bias=header.initial_predictions[0], activation=activation)
+
+    @property
+    def arrays(self) -> Dict[str, np.ndarray]:
+        arrays = {k: getattr(self, k) for k in self.ARRAYS}
+        if self.cover is not None:
+            arrays['cover'] = self.cover
+        return arrays
+
+    @staticmethod
+    def read_arrays(f) -> Dict[str, np.ndarray]:
+        """Arrays of an opened npz file, optional ones only if present"""
+        return {k: f[k] for k in CompiledForest.ARRAYS + CompiledForest.OPTIONAL_ARRAYS if k in f.files}
+
+    @property
+    def meta(self) -> dict:
+        return {
+            'feature_names': self.feature_names,
+            'vocabularies': self.vocabularies,
+            'bias': self.bias,
+            'activation': self.activation
+        }
+
+    def save(self, path: str) -> None:
+        np.savez(path, meta=np.array(json.dumps(self.meta)), **self.arrays)
+
+    @classmethod
+    def load(cls, path: str) -> 'CompiledForest':
+        with np.load(path, allow_pickle=False) as f:
+            meta = json.loads(str(f['meta']))
+            arrays = cls.read_arrays(f)
+        return cls(arrays, **meta)
+
+    def encode(self, data: pd.DataFrame) -> np.ndarray:
+        """
+        Builds the float32 feature matrix in model order; categorical values become dictionary indices.
+        Missing categorical values (null or '', as TF-DF reads them) become NaN, so they follow the
+        missing_evaluation branch of each node instead of the out-of-dictionary index.
+        """
+        X = np.empty((len(data), len(self.feature_names)), dtype=np.float32)
+        for i, name in enumerate(self.feature_names):
+            if name in self.vocabularies:
+                mapping = {item: j for j, item in enumerate(self.vocabularies[name])}
+                values = data[name]
+                missing = (values.isna() | (values == '')).values
+                X[:, i] = values.astype(str).map(mapping).fillna(OOD_INDEX).values
+                X[missing, i] = np.nan
+            else:
+                X[:, i] = data[name].values
+        return X
+
+    def compute_cover(self, X: Union[np.ndarray, pd.DataFrame]) -> 'CompiledForest':
+        """Sets cover to the number of rows of X (e.g. a training sample) reaching each node"""
+        if isinstance(X, pd.DataFrame):
+            X = self.encode(X)
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        self.cover = _node_counts(X, *self.kernel_args()[:-2])
+        return self
+
+    def kernel_args(self, num_trees: Optional[int] = None) -> tuple:
+        return (
+            self.roots[:num_trees], self.kind, self.feature, self.threshold, self.cat_mask,
+            self.missing_pos, self.pos_child, self.neg_child, self.value, self.bias
+        )
+
+    def predict_margin(self, X: np.ndarray, num_trees: Optional[int] = None) -> np.ndarray:
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        assert X.ndim == 2 and X.shape[1] == len(self.feature_names), \
+            f'Expected a matrix with {len(self.feature_names)} features'
+        return _predict_margin(X, *self.kernel_args(num_trees))
+
+    def predict(self, X: Union[np.ndarray, pd.DataFrame], num_trees: Optional[int] = None) -> np.ndarray:
+        if isinstance(X, pd.DataFrame):
+            X = self.encode(X)
+        margin = self.predict_margin(X, num_trees=num_trees)
+        if self.activation == 'sigmoid':
+            return (1.0 / (1.0 + np.exp(-margin))).astype(np.float32)
+        return margin.astype(np.float32)
+
+    def __repr__(self) -> str:
+        return f'CompiledForest(num_trees={self.num_trees}, num_nodes={self.num_nodes}, activation={self.activation})'
+
+
+def export_forest(
+        model: Any,
+        path: str,
+        validation_data: Optional[pd.DataFrame] = None,
+        atol: float = 1e-5
+) -> CompiledForest:
+    """
+    Exports a trained TF-DF model to a .npz file readable without TensorFlow.
+    If validation_data (model input columns only) is given, scores are checked against model.predict.
+    """
+    forest = CompiledForest.from_tfdf(model)
+
+    if validation_data is not None:
+        import tensorflow_decision_forests as tfdf
+
+        expected = model.predict(tfdf.keras.pd_dataframe_to_tf_dataset(validation_data), verbose=0).flatten()
+        max_diff = np.max(np.abs(forest.predict(validation_data) - expected))
+        assert max_diff <= atol, f'Compiled forest deviates from TF-DF by {max_diff}'
+
+    forest.save(path)
+    return forest
@@ -0,0 +1,252 @@
+import json
+import polars as pl
+
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Set, Tuple, Union
+
+try:
+    from ._utils import MIN_LOCATION_BOOKINGS, MIN_FREQ_LOCATIONS
+except ImportError:
+    from _utils import MIN_LOCATION_BOOKINGS, MIN_FREQ_LOCATIONS
+
+
+def _location_key(lat: float, long: float) -> str:
+    # same rounding as format('%.3f', round(x, 3)) in get_rh_features
+    return f'{float(lat):.3f}|{float(long):.3f}'
+
+
+def _parse_ts(ts: Union[str, datetime]) -> datetime:
+    if isinstance(ts, datetime):
+        return ts
+    return datetime.strptime(str(ts)[:19], '%Y-%m-%d %H:%M:%S')
+
+
+BOOKING_COLUMNS = ['booking_id', 'customer_id', 'ts', 'pickup_lat', 'pickup_long', 'dropoff_lat', 'dropoff_long']
+
+
+class Booking(object):
+    __slots__ = ('booking_id', 'customer_id', 'ts', 'pickup', 'dropoff')
+
+    def __init__(
+            self,
+            booking_id: int,
+            customer_id: int,
+            ts: Union[str, datetime],
+            pickup_lat: float,
+            pickup_long: float,
+            dropoff_lat: float,
+            dropoff_long: float
+    ):
+        self.booking_id = int(booking_id)
+        self.customer_id = int(customer_id)
+        self.ts = _parse_ts(ts)  # local time, as in get_rh_features
+        self.pickup = _location_key(pickup_lat, pickup_long)
+        self.dropoff = _location_key(dropoff_lat, dropoff_long)
+
+    @property
+    def locations(self) -> Set[str]:
+        # count(distinct booking_id) per location: pickup == dropoff counts once
+        return {self.pickup, self.dropoff}
+
+
+class CustomerProfile(object):
+    """
+    Running version of the per-customer aggregates of get_rh_features.
+    Week/hour histograms are kept per dropoff location, so a location crossing the
+    MIN_LOCATION_BOOKINGS threshold only adds/removes its own histogram (constant work).
+    """
+    __slots__ = ('num_trips', 'location_counts', 'dropoff_week', 'dropoff_hour', 'week', 'hour', 'num_freq')
+
+    def __init__(self):
+        self.num_trips = 0
+        self.location_counts: Dict[str, int] = {}
+        self.dropoff_week: Dict[str, List[int]] = {}
+        self.dropoff_hour: Dict[str, List[int]] = {}
+        self.week = [0] * 7  # ISO weekday - 1, like extract(DOW from ts) - 1
+        self.hour = [0] * 24
+        self.num_freq = 0
+
+    def _is_freq(self, location: str) -> bool:
+        return self.location_counts.get(location, 0) >= MIN_LOCATION_BOOKINGS
+
+    def _shift_histograms(self, location: str, sign: int) -> None:
+        if location in self.dropoff_week:
+            for i, v in enumerate(self.dropoff_week[location]):
+                self.week[i] += sign * v
+            for i, v in enumerate(self.dropoff_hour[location]):
+                self.hour[i] += sign * v
+
+    def add(self, booking: Booking) -> None:
+        dow, hour = booking.ts.isoweekday() - 1, booking.ts.hour
+        dropoff_was_freq = self._is_freq(booking.dropoff)
+
+        self.num_trips += 1
+        self.dropoff_week.setdefault(booking.dropoff, [0] * 7)[dow] += 1
+        self.dropoff_hour.setdefault(booking.dropoff, [0] * 24)[hour] += 1
+
+        if dropoff_was_freq:
+            self.week[dow] += 1
+            self.hour[hour] += 1
+
+        for location in booking.locations:
+            count = self.location_counts.get(location, 0) + 1
+            self.location_counts[location] = count
+            if count == MIN_LOCATION_BOOKINGS:
+                # histogram already includes this booking if location is its dropoff
+                self.num_freq += 1
+                self._shift_histograms(location, 1)
+
+    def remove(self, booking: Booking) -> None:
+        dow, hour = booking.ts.isoweekday() - 1, booking.ts.hour
+
+        for location in booking.locations:
+            count = self.location_counts[location]
+            if count == MIN_LOCATION_BOOKINGS:
+                self.num_freq -= 1
+                self._shift_histograms(location, -1)
+            if count == 1:
+                del self.location_counts[location]
+            else:
+                self.location_counts[location] = count - 1
+
+        if self._is_freq(booking.dropoff):
+            self.week[dow] -= 1
+            self.hour[hour] -= 1
+
+        self.num_trips -= 1
+        self.dropoff_week[booking.dropoff][dow] -= 1
+        self.dropoff_hour[booking.dropoff][hour] -= 1
+        if not any(self.dropoff_week[booking.dropoff]):
+            del self.dropoff_week[booking.dropoff]
+            del self.dropoff_hour[booking.dropoff]
+
+    @property
+    def is_eligible(self) -> bool:
+        # having cardinality(...) >= 2 and week_stats is not null
+        return self.num_freq >= MIN_FREQ_LOCATIONS and any(self.week)
+
+    def to_features(self) -> dict:
+        return {
+            'num_trips': self.num_trips,
+            'week_stats': json.dumps({str(i + 1): v for i, v in enumerate(self.week) if v > 0}),
+            'hour_stats': json.dumps({str(i): v for i, v in enumerate(self.hour) if v > 0}),
+            'locations': json.dumps(
+                {k: v for k, v in self.location_counts.items() if v >= MIN_LOCATION_BOOKINGS}
+            )
+        }
+
+
+class ProfileUpdater(object):
+    """
+    Applies completed bookings to customer profiles as they arrive, between daily
+    get_rh_features snapshots.
+
+    The window holds the last history_horizon + 1 days up to and including the current day,
+    i.e. the profile the next daily snapshot would compute. Bookings are bucketed by local day,
+    so expiring a day only touches the bookings of that day.
+    quantile, trx_amt and home_work_coords are not maintained and are taken from the snapshot.
+    """
+    def __init__(self, history_horizon: int = 60):
+        self.history_horizon = history_horizon
+        self.profiles: Dict[int, CustomerProfile] = defaultdict(CustomerProfile)
+        self.bookings: Dict[int, Booking] = {}
+        self.days: Dict[date, List[int]] = defaultdict(list)
+        self.current_day: Optional[date] = None
+        self.dirty: Set[int] = set()
+
+    @classmethod
+    def from_bookings(cls, bookings: pl.DataFrame, history_horizon: int = 60) -> 'ProfileUpdater':
+        """Seed from the output of get_rh_bookings"""
+        updater = cls(history_horizon=history_horizon)
+        updater.apply_many(bookings.sort('ts').iter_rows(named=True))
+        updater.dirty.clear()
+        return updater
+
+    @property
+    def window_start(self) -> date:
+        return self.current_day - timedelta(days=self.history_horizon)
+
+    def apply(self, booking: Union[Booking, dict]) -> bool:
+        """Adds one completed booking. Returns False for duplicates and bookings outside the window"""
+        if isinstance(booking, dict):
+            booking = Booking(**{k: booking[k] for k in BOOKING_COLUMNS})
+
+        if booking.booking_id in self.bookings:
+            return False
+
+        day = booking.ts.date()
+        if self.current_day is None or day > self.current_day:
+            self.advance(day)
+        elif day < self.window_start:
+            return False
+
+        self.bookings[booking.booking_id] = booking
+        self.days[day].append(booking.booking_id)
+        self.profiles[booking.customer_id].add(booking)
+        self.dirty.add(booking.customer_id)
+        return True
+
+    def apply_many(self, bookings: Iterable[Union[Booking, dict]]) -> int:
+        return sum(self.apply(b) for b in bookings)
+
+    def advance(self, day: Union[str, date]) -> int:
+        """Moves the window to end at day and expires older bookings. Returns number of expired bookings"""
+        if isinstance(day, str):
+            day = date.fromisoformat(day)
+        if self.current_day is not None and day <= self.current_day:
+            return 0
+
+        self.current_day = day
+        expired = 0
+
+        for bucket in sorted(d for d in self.days.keys() if d < self.window_start):
+            for booking_id in self.days.pop(bucket):
+                booking = self.bookings.pop(booking_id)
+                profile = self.profiles[booking.customer_id]
+                profile.remove(booking)
+                if profile.num_trips == 0:
+                    del self.profiles[booking.customer_id]
+                self.dirty.add(booking.customer_id)
+                expired += 1
+
+        return expired
+
+    def get_features(self, customer_id: int) -> Optional[dict]:
+        profile = self.profiles.get(customer_id)
+        if profile is None or not profile.is_eligible:
+            return None
+        return profile.to_features()
+
+    def _updates(self, customer_ids: Iterable[int]) -> Tuple[pl.DataFrame, List[int]]:
+        rows, ineligible = [], []
+        for customer_id in customer_ids:
+            features = self.get_features(customer_id)
+            if features is None:
+                ineligible.append(customer_id)
+            else:
+                rows.append({'customer_id': customer_id, **features})
+
+        schema = {'customer_id': pl.Int64, 'num_trips': pl.Int64, 'week_stats': pl.Utf8,
+                  'hour_stats': pl.Utf8, 'locations': pl.Utf8}
+        return pl.DataFrame(rows, schema=schema), ineligible
+
+    def update_features(self, features: pl.DataFrame, only_dirty: bool = True) -> pl.DataFrame:
+        """
+        Overlays current profiles onto a daily features snapshot. Customers that are no longer
+        eligible are dropped; customers missing from the snapshot are skipped, since quantile,
+        trx_amt and home_work_coords are not known for them.
+        """
+        customer_ids = self.dirty if only_dirty else self.profiles.keys()
+        updates, ineligible = self._updates(list(customer_ids))
+        self.dirty = set()
+
+        cols = [x for x in updates.columns if x != 'customer_id']
+        updates = updates.with_columns(pl.col('customer_id').cast(features.schema['customer_id']))
+
+        features = features.filter(~pl.col('customer_id').is_in(ineligible))
+        features = features.join(updates.rename({x: f'{x}_new' for x in cols}), on='customer_id', how='left')
+        features = features.with_columns([
+            pl.coalesce([pl.col(f'{x}_new'), pl.col(x)]).cast(features.schema[x]).alias(x) for x in cols
+        ])
+        return features.drop([f'{x}_new' for x in cols])
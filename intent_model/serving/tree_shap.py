@@ -0,0 +1,298 @@
+import numpy as np
+import pandas as pd
+
+from typing import Optional, Tuple, Union
+from numba import jit, prange
+
+try:
+    from .forest import CompiledForest, LEAF, NUMERICAL, _node_counts
+    from .calibrator import Calibrator
+except ImportError:
+    from forest import CompiledForest, LEAF, NUMERICAL, _node_counts
+    from calibrator import Calibrator
+
+OUTPUTS = ('margin', 'probability', 'calibrated')
+
+
+@jit(nopython=True, nogil=True, cache=True)
+def _go_pos(x: float, node: int, kind: np.ndarray, threshold: np.ndarray, cat_mask: np.ndarray,
+            missing_pos: np.ndarray) -> bool:
+    # same routing as _row_margin
+    if np.isnan(x):
+        return missing_pos[node]
+    if kind[node] == NUMERICAL:
+        return x >= threshold[node]
+    c = np.uint64(x)
+    return c < 64 and ((cat_mask[node] >> c) & np.uint64(1)) == 1
+
+
+@jit(nopython=True, nogil=True, cache=True)
+def _extend_path(
+        features: np.ndarray, zeros: np.ndarray, ones: np.ndarray, weights: np.ndarray,
+        start: int, depth: int, zero_fraction: float, one_fraction: float, feature: int
+) -> None:
+    features[start + depth] = feature
+    zeros[start + depth] = zero_fraction
+    ones[start + depth] = one_fraction
+    weights[start + depth] = 1.0 if depth == 0 else 0.0
+    for i in range(depth - 1, -1, -1):
+        weights[start + i + 1] += one_fraction * weights[start + i] * (i + 1) / (depth + 1)
+        weights[start + i] = zero_fraction * weights[start + i] * (depth - i) / (depth + 1)
+
+
+@jit(nopython=True, nogil=True, cache=True)
+def _unwind_path(
+        features: np.ndarray, zeros: np.ndarray, ones: np.ndarray, weights: np.ndarray,
+        start: int, depth: int, index: int
+) -> None:
+    one_fraction = ones[start + index]
+    zero_fraction = zeros[start + index]
+    next_one = weights[start + depth]
+    for i in range(depth - 1, -1, -1):
+        if one_fraction != 0:
+            tmp = weights[start + i]
+            weights[start + i] = next_one * (depth + 1) / ((i + 1) * one_fraction)
+            next_one = tmp - weights[start + i] * zero_fraction * (depth - i) / (depth + 1)
+        else:
+            weights[start + i] = weights[start + i] * (depth + 1) / (zero_fraction * (depth - i))
+    for i in range(index, depth):
+        features[start + i] = features[start + i + 1]
+        zeros[start + i] = zeros[start + i + 1]
+        ones[start + i] = ones[start + i + 1]
+
+
+@jit(nopython=True, nogil=True, cache=True)
+def _unwound_path_sum(
+        zeros: np.ndarray, ones: np.ndarray, weights: np.ndarray, start: int, depth: int, index: int
+) -> float:
+    one_fraction = ones[start + index]
+    zero_fraction = zeros[start + index]
+    next_one = weights[start + depth]
+    total = 0.0
+    for i in range(depth - 1, -1, -1):
+        if one_fraction != 0:
+            tmp = next_one / ((i + 1) * one_fraction)
+            total += tmp
+            next_one = weights[start + i] - tmp * zero_fraction * (depth - i)
+        else:
+            total += weights[start + i] / (zero_fraction * (depth - i))
+    return total * (depth + 1)
+
+
+@jit(nopython=True, nogil=True, cache=True)
+def _tree_shap(
+        X: np.ndarray, i: int, phi: np.ndarray, root: int,
+        kind: np.ndarray, feature: np.ndarray, threshold: np.ndarray, cat_mask: np.ndarray,
+        missing_pos: np.ndarray, pos_child: np.ndarray, neg_child: np.ndarray, value: np.ndarray,
+        cover: np.ndarray,
+        features: np.ndarray, zeros: np.ndarray, ones: np.ndarray, weights: np.ndarray,
+        stack: np.ndarray, stack_fractions: np.ndarray
+) -> None:
+    # Algorithm 2 of Lundberg et al. (2018) with an explicit stack of (node, depth, parent start, feature)
+    # and (zero fraction, one fraction). Each depth copies its path into the next slice of the buffers,
+    # so the parent path is still intact when the second child is popped.
+    stack[0, 0], stack[0, 1], stack[0, 2], stack[0, 3] = root, 0, 0, -1
+    stack_fractions[0, 0], stack_fractions[0, 1] = 1.0, 1.0
+    top = 1
+    while top > 0:
+        top -= 1
+        node, depth, parent_start, parent_feature = stack[top, 0], stack[top, 1], stack[top, 2], stack[top, 3]
+        start = parent_start + depth
+        for j in range(depth):
+            features[start + j] = features[parent_start + j]
+            zeros[start + j] = zeros[parent_start + j]
+            ones[start + j] = ones[parent_start + j]
+            weights[start + j] = weights[parent_start + j]
+        _extend_path(
+            features, zeros, ones, weights, start, depth,
+            stack_fractions[top, 0], stack_fractions[top, 1], parent_feature
+        )
+
+        if kind[node] == LEAF:
+            for j in range(1, depth + 1):
+                w = _unwound_path_sum(zeros, ones, weights, start, depth, j)
+                phi[features[start + j]] += w * (ones[start + j] - zeros[start + j]) * value[node]
+            continue
+
+        split = feature[node]
+        if _go_pos(X[i, split], node, kind, threshold, cat_mask, missing_pos):
+            hot, cold = pos_child[node], neg_child[node]
+        else:
+            hot, cold = neg_child[node], pos_child[node]
+        if cover[node] > 0:
+            hot_zero, cold_zero = cover[hot] / cover[node], cover[cold] / cover[node]
+        else:
+            hot_zero, cold_zero = 0.5, 0.5  # unseen by the cover data, any split of the mass stays additive
+
+        incoming_zero, incoming_one = 1.0, 1.0
+        index = 1
+        while index <= depth and features[start + index] != split:
+            index += 1
+        if index <= depth:
+            incoming_zero, incoming_one = zeros[start + index], ones[start + index]
+            _unwind_path(features, zeros, ones, weights, start, depth, index)
+            depth -= 1
+
+        # branches no coalition can reach (no cover and off the row's path) add nothing
+        if cold_zero * incoming_zero > 0:
+            stack[top, 0], stack[top, 1], stack[top, 2], stack[top, 3] = cold, depth + 1, start, split
+            stack_fractions[top, 0], stack_fractions[top, 1] = cold_zero * incoming_zero, 0.0
+            top += 1
+        if hot_zero * incoming_zero > 0 or incoming_one > 0:
+            stack[top, 0], stack[top, 1], stack[top, 2], stack[top, 3] = hot, depth + 1, start, split
+            stack_fractions[top, 0], stack_fractions[top, 1] = hot_zero * incoming_zero, incoming_one
+            top += 1
+
+
+@jit(nopython=True, parallel=True, nogil=True, cache=True)
+def _shap_values(
+        X: np.ndarray,
+        roots: np.ndarray,
+        kind: np.ndarray,
+        feature: np.ndarray,
+        threshold: np.ndarray,
+        cat_mask: np.ndarray,
+        missing_pos: np.ndarray,
+        pos_child: np.ndarray,
+        neg_child: np.ndarray,
+        value: np.ndarray,
+        cover: np.ndarray,
+        max_depth: int
+) -> np.ndarray:
+    size = (max_depth + 2) * (max_depth + 3) // 2
+    phi = np.zeros(X.shape, dtype=np.float64)
+    for i in prange(X.shape[0]):
+        features = np.empty(size, dtype=np.int64)
+        zeros = np.empty(size, dtype=np.float64)
+        ones = np.empty(size, dtype=np.float64)
+        weights = np.empty(size, dtype=np.float64)
+        stack = np.empty((max_depth + 2, 4), dtype=np.int64)
+        stack_fractions = np.empty((max_depth + 2, 2), dtype=np.float64)
+        for t in range(roots.shape[0]):
+            _tree_shap(
+                X, i, phi[i], roots[t], kind, feature, threshold, cat_mask, missing_pos, pos_child, neg_child,
+                value, cover, features, zeros, ones, weights, stack, stack_fractions
+            )
+    return phi
+
+
+@jit(nopython=True, nogil=True, cache=True)
+def _tree_stats(
+        roots: np.ndarray, kind: np.ndarray, pos_child: np.ndarray, neg_child: np.ndarray, value: np.ndarray,
+        cover: np.ndarray
+) -> Tuple[float, int]:
+    """Sum over trees of the cover-weighted mean leaf value, and the maximum depth"""
+    expected = np.zeros(kind.shape[0], dtype=np.float64)
+    depth = np.zeros(kind.shape[0], dtype=np.int64)
+    order = np.empty(kind.shape[0], dtype=np.int64)
+    total, max_depth = 0.0, 0
+    for t in range(roots.shape[0]):
+        # preorder, then children before parents
+        order[0], size, k = roots[t], 1, 0
+        while k < size:
+            node = order[k]
+            if kind[node] != LEAF:
+                order[size], order[size + 1] = pos_child[node], neg_child[node]
+                size += 2
+            k += 1
+        for k in range(size - 1, -1, -1):
+            node = order[k]
+            if kind[node] == LEAF:
+                expected[node], depth[node] = value[node], 0
+                continue
+            pos, neg = pos_child[node], neg_child[node]
+            if cover[node] > 0:
+                expected[node] = (cover[pos] * expected[pos] + cover[neg] * expected[neg]) / cover[node]
+            else:
+                expected[node] = (expected[pos] + expected[neg]) / 2
+            depth[node] = 1 + max(depth[pos], depth[neg])
+        total += expected[roots[t]]
+        max_depth = max(max_depth, depth[roots[t]])
+    return total, max_depth
+
+
+class TreeExplainer(object):
+    """
+    Exact path-dependent TreeSHAP (Lundberg et al., 2018) over a CompiledForest, rows in parallel.
+    Replaces shap.KernelExplainer over model.predict: no sampling, no background dataset per call.
+
+    Node covers come from the forest (TF-DF example counts) or from background rows
+    (e.g. a training sample), see CompiledForest.compute_cover.
+    Outputs:
+        - margin: SHAP values of the GBT logit, exact
+        - probability / calibrated: margin SHAP values rescaled by (g(margin) - g(E)) / (margin - E)
+          for g the sigmoid (and the isotonic mapping), so they sum to the explained score minus
+          expected_value(output) like the KernelExplainer ones
+    """
+    def __init__(
+            self,
+            forest: CompiledForest,
+            background: Optional[Union[np.ndarray, pd.DataFrame]] = None,
+            calibrator: Optional[Calibrator] = None
+    ):
+        self.forest = forest
+        if background is not None:
+            if isinstance(background, pd.DataFrame):
+                background = forest.encode(background)
+            background = np.ascontiguousarray(background, dtype=np.float32)
+            self.cover = _node_counts(background, *forest.kernel_args()[:-2])
+        else:
+            assert forest.cover is not None, 'The forest has no node covers, pass background rows'
+            self.cover = forest.cover
+        self.calibrator = calibrator
+        expected, self.max_depth = _tree_stats(
+            forest.roots, forest.kind, forest.pos_child, forest.neg_child, forest.value, self.cover
+        )
+        self.expected_margin = forest.bias + expected
+
+    @classmethod
+    def from_artifact(
+            cls,
+            artifact,
+            background: Optional[Union[np.ndarray, pd.DataFrame]] = None
+    ) -> 'TreeExplainer':
+        """Explainer of a ScoringArtifact, calibrated output through its knots"""
+        return cls(artifact.forest, background, Calibrator(artifact.x_knots, artifact.y_knots))
+
+    def _transform(self, margin: np.ndarray, output: str) -> np.ndarray:
+        assert output in OUTPUTS, f'output must be one of {OUTPUTS}'
+        if output == 'margin':
+            return margin
+        assert self.forest.activation == 'sigmoid', f'No probability for activation {self.forest.activation}'
+        score = 1.0 / (1.0 + np.exp(-margin))
+        if output == 'probability':
+            return score
+        assert self.calibrator is not None, 'No calibrator to explain the calibrated score'
+        return self.calibrator(score).astype(np.float64)
+
+    def expected_value(self, output: str = 'margin') -> float:
+        return float(self._transform(np.array([self.expected_margin]), output)[0])
+
+    def shap_values(self, X: Union[np.ndarray, pd.DataFrame], output: str = 'margin') -> np.ndarray:
+        """(rows, features) SHAP values in forest.feature_names order"""
+        if isinstance(X, pd.DataFrame):
+            X = self.forest.encode(X)
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        assert X.ndim == 2 and X.shape[1] == len(self.forest.feature_names), \
+            f'Expected a matrix with {len(self.forest.feature_names)} features'
+
+        f = self.forest
+        phi = _shap_values(
+            X, f.roots, f.kind, f.feature, f.threshold, f.cat_mask, f.missing_pos, f.pos_child, f.neg_child,
+            f.value, self.cover, self.max_depth
+        )
+        if output == 'margin':
+            return phi
+
+        margin = phi.sum(axis=1) + self.expected_margin
+        delta = margin - self.expected_margin
+        change = self._transform(margin, output) - self.expected_value(output)
+        # at the expected margin the ratio is the local slope of the output
+        h = 1e-4
+        slope = (self._transform(margin + h, output) - self._transform(margin - h, output)) / (2 * h)
+        small = np.abs(delta) < 1e-9
+        scale = np.where(small, slope, change / np.where(small, 1.0, delta))
+        return phi * scale[:, None]
+
+    def __repr__(self) -> str:
+        return f'TreeExplainer(forest={self.forest}, max_depth={self.max_depth}, calibrated={self.calibrator is not None})'
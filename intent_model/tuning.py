@@ -0,0 +1,220 @@
+import os
+import argparse
+import multiprocessing
+import numpy as np
+import pandas as pd
+import optuna
+
+from typing import Optional, Sequence, Tuple
+
+try:
+    from .preprocessing.shards import SCHEMA_FILE, read_records, read_schema, shard_dataset, write_shards
+    from .serving.forest import CompiledForest
+except ImportError:
+    from preprocessing.shards import SCHEMA_FILE, read_records, read_schema, shard_dataset, write_shards
+    from serving.forest import CompiledForest
+
+FIXED_PARAMS = {
+    'max_depth': None,
+    'growing_strategy': 'BEST_FIRST_GLOBAL',
+    'categorical_algorithm': 'CART',
+    'validation_ratio': 0.1,
+    'random_seed': 42
+}
+
+
+def suggest_params(trial: optuna.Trial) -> dict:
+    """Search space around the hand-tuned notebook settings"""
+    return {
+        'num_trees': trial.suggest_int('num_trees', 100, 500, step=50),
+        'max_num_nodes': trial.suggest_categorical('max_num_nodes', [16, 32, 64, 128]),
+        'subsample': trial.suggest_float('subsample', 0.6, 1.0),
+        'shrinkage': trial.suggest_float('shrinkage', 0.02, 0.3, log=True),
+        'loss': trial.suggest_categorical('loss', ['BINOMIAL_LOG_LIKELIHOOD', 'BINARY_FOCAL_LOSS'])
+    }
+
+
+def _validation_data(shards_path: str) -> Tuple[pd.DataFrame, np.ndarray, np.ndarray]:
+    """Validation features (categoricals as str, as in training), labels and weights from the shards"""
+    schema = read_schema(shards_path)
+    records = read_records(shards_path, 'val')
+    frame = pd.DataFrame(records[:, :len(schema['features'])], columns=schema['features'])
+    for name, values in schema['vocabularies'].items():
+        frame[name] = np.asarray(values)[frame[name].values.astype(np.int64)]
+    return frame, records[:, -2], records[:, -1]
+
+
+def _log_loss(y: np.ndarray, p: np.ndarray, w: np.ndarray) -> float:
+    p = np.clip(p, 1e-7, 1 - 1e-7)
+    return float(-np.sum(w * (y * np.log(p) + (1 - y) * np.log(1 - p))) / np.sum(w))
+
+
+class Objective(object):
+    """
+    Recall at target_precision on the validation split (as get_optimal_threshold), to maximise.
+
+    tfdf trains all trees in one call, so pruning works on budget stages: a trial first trains
+    stages[0] * num_trees trees and reports the weighted validation log loss (negated, higher is
+    better) every report_every trees, scored with CompiledForest on tree prefixes. The pruner
+    compares these with other trials at the same number of trees, so unpromising settings stop
+    before the full-size model is trained.
+    """
+    def __init__(
+            self,
+            shards_path: str,
+            target_precision: float = 0.9,
+            stages: Sequence[float] = (0.25, 1.0),
+            report_every: int = 25,
+            num_threads: int = 1,
+            batch_size: int = 4096
+    ):
+        self.shards_path = shards_path
+        self.target_precision = target_precision
+        self.stages = stages
+        self.report_every = report_every
+        self.num_threads = num_threads
+        self.batch_size = batch_size
+        self.val_frame, self.val_y, self.val_w = _validation_data(shards_path)
+
+    def _train(self, params: dict, num_trees: int) -> CompiledForest:
+        import tensorflow_decision_forests as tfdf
+
+        model = tfdf.keras.GradientBoostedTreesModel(
+            task=tfdf.builder.Task.CLASSIFICATION,
+            num_threads=self.num_threads,
+            verbose=0,
+            **FIXED_PARAMS,
+            **dict(params, num_trees=num_trees)
+        )
+        model.fit(shard_dataset(self.shards_path, 'train', batch_size=self.batch_size), verbose=0)
+        return CompiledForest.from_tfdf(model)
+
+    def __call__(self, trial: optuna.Trial) -> float:
+        try:
+            from .functions import get_optimal_threshold
+        except ImportError:
+            from functions import get_optimal_threshold
+
+        params = suggest_params(trial)
+        reported = 0
+
+        for fraction in self.stages:
+            forest = self._train(params, max(1, int(round(params['num_trees'] * fraction))))
+            X = forest.encode(self.val_frame)
+
+            # common steps for all trials, so the pruner can compare them
+            steps = list(range(self.report_every, forest.num_trees + 1, self.report_every)) or [forest.num_trees]
+            for step in [x for x in steps if x > reported]:
+                loss = _log_loss(self.val_y, forest.predict(X, num_trees=step), self.val_w)
+                trial.report(-loss, step)
+                reported = step
+
+            if trial.should_prune():
+                raise optuna.TrialPruned()
+
+        threshold, recall = get_optimal_threshold(self.val_y, forest.predict(X), self.target_precision)
+        trial.set_user_attr('threshold', float(threshold))
+        trial.set_user_attr('num_trees_trained', forest.num_trees)
+        return float(recall)
+
+
+def _worker(
+        worker: int,
+        study_name: str,
+        storage: str,
+        shards_path: str,
+        n_trials: int,
+        num_threads: int,
+        target_precision: float,
+        seed: int,
+        timeout: Optional[float]
+) -> None:
+    import numba
+    numba.set_num_threads(num_threads)
+
+    study = optuna.load_study(
+        study_name=study_name,
+        storage=storage,
+        sampler=optuna.samplers.TPESampler(seed=seed + worker),
+        pruner=optuna.pruners.MedianPruner(n_startup_trials=5, n_warmup_steps=0)
+    )
+    objective = Objective(shards_path, target_precision, num_threads=num_threads)
+    study.optimize(
+        objective,
+        n_trials=n_trials,
+        timeout=timeout,
+        callbacks=[optuna.study.MaxTrialsCallback(
+            n_trials, states=(optuna.trial.TrialState.COMPLETE, optuna.trial.TrialState.PRUNED)
+        )]
+    )
+
+
+def tune(
+        shards_path: str,
+        study_name: str = 'gbt',
+        storage: str = 'sqlite:///tuning.db',
+        n_trials: int = 50,
+        n_workers: Optional[int] = None,
+        dataset_path: Optional[str] = None,
+        target_precision: float = 0.9,
+        seed: int = 42,
+        timeout: Optional[float] = None
+) -> optuna.Study:
+    """
+    Runs n_trials trials of Objective in n_workers processes (all cores by default) sharing one
+    study in storage, so a sweep can be resumed or extended by running it again.
+    Train/val shards are written once from dataset_path (see write_shards) if shards_path has none;
+    every trial then streams them instead of rebuilding datasets from pandas.
+    Cores are divided between workers for tfdf training and forest scoring.
+    """
+    if not os.path.exists(os.path.join(shards_path, SCHEMA_FILE)):
+        assert dataset_path is not None, f'No shards in {shards_path}, dataset_path is needed to write them'
+        write_shards(dataset_path, shards_path)
+
+    n_workers = n_workers or os.cpu_count()
+    num_threads = max(1, os.cpu_count() // n_workers)
+
+    optuna.create_study(study_name=study_name, storage=storage, direction='maximize', load_if_exists=True)
+
+    context = multiprocessing.get_context('spawn')
+    processes = [
+        context.Process(
+            target=_worker,
+            args=(worker, study_name, storage, shards_path, n_trials, num_threads, target_precision, seed, timeout)
+        )
+        for worker in range(n_workers)
+    ]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+
+    study = optuna.load_study(study_name=study_name, storage=storage)
+    print(f'Best recall@{target_precision}: {study.best_value:.4f} with {study.best_params}')
+    return study
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Parallel GBT hyperparameter search')
+    parser.add_argument('--shards', required=True, help='directory with train/val shards (see write_shards)')
+    parser.add_argument('--dataset', default=None, help='dataset.pq to write the shards from if missing')
+    parser.add_argument('--study-name', default='gbt')
+    parser.add_argument('--storage', default='sqlite:///tuning.db')
+    parser.add_argument('--n-trials', type=int, default=50)
+    parser.add_argument('--n-workers', type=int, default=None)
+    parser.add_argument('--target-precision', type=float, default=0.9)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--timeout', type=float, default=None)
+    args = parser.parse_args()
+
+    tune(
+        shards_path=args.shards,
+        study_name=args.study_name,
+        storage=args.storage,
+        n_trials=args.n_trials,
+        n_workers=args.n_workers,
+        dataset_path=args.dataset,
+        target_precision=args.target_precision,
+        seed=args.seed,
+        timeout=args.timeout
+    )
@@ -0,0 +1,310 @@
+import json
+import numpy as np
+
+from typing import Iterable, Optional, Tuple
+from numba import jit
+
+
+@jit(nopython=True, nogil=True, cache=True)
+def pava(y: np.ndarray, w: np.ndarray) -> np.ndarray:
+    """Pool adjacent violators for a non-decreasing fit of y with weights w"""
+    n = y.shape[0]
+    means = np.empty(n, dtype=np.float64)
+    weights = np.empty(n, dtype=np.float64)
+    ends = np.empty(n, dtype=np.int64)
+    k = -1
+
+    for i in range(n):
+        k += 1
+        means[k], weights[k], ends[k] = y[i], w[i], i
+        while k > 0 and means[k - 1] > means[k]:
+            total = weights[k - 1] + weights[k]
+            means[k - 1] = (means[k - 1] * weights[k - 1] + means[k] * weights[k]) / total
+            weights[k - 1] = total
+            ends[k - 1] = ends[k]
+            k -= 1
+
+    out = np.empty(n, dtype=np.float64)
+    start = 0
+    for b in range(k + 1):
+        out[start:ends[b] + 1] = means[b]
+        start = ends[b] + 1
+    return out
+
+
+@jit(nopython=True, nogil=True, cache=True)
+def _merge_sorted(
+        x1: np.ndarray, s1: np.ndarray, w1: np.ndarray,
+        x2: np.ndarray, s2: np.ndarray, w2: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Merges two sorted unique key arrays with their sums and weights, adding up equal keys"""
+    n1, n2 = x1.shape[0], x2.shape[0]
+    x = np.empty(n1 + n2, dtype=x1.dtype)
+    s = np.empty(n1 + n2, dtype=np.float64)
+    w = np.empty(n1 + n2, dtype=np.float64)
+    i, j, k = 0, 0, 0
+
+    while i < n1 or j < n2:
+        if j == n2 or (i < n1 and x1[i] < x2[j]):
+            x[k], s[k], w[k] = x1[i], s1[i], w1[i]
+            i += 1
+        elif i == n1 or x2[j] < x1[i]:
+            x[k], s[k], w[k] = x2[j], s2[j], w2[j]
+            j += 1
+        else:
+            x[k], s[k], w[k] = x1[i], s1[i] + s2[j], w1[i] + w2[j]
+            i += 1
+            j += 1
+        k += 1
+
+    return x[:k], s[:k], w[:k]
+
+
+def isotonic_y(
+        y: np.ndarray,
+        w: np.ndarray,
+        increasing: bool = True,
+        y_min: Optional[float] = None,
+        y_max: Optional[float] = None
+) -> np.ndarray:
+    """Weighted monotone fit of the means y of sorted unique X with total weights w, clipped to [y_min, y_max]"""
+    y, w = np.asarray(y, dtype=np.float64), np.asarray(w, dtype=np.float64)
+    iso_y = pava(y, w) if increasing else -pava(-y, w)
+    if y_min is not None or y_max is not None:
+        iso_y = np.clip(iso_y, y_min, y_max)
+    return iso_y.astype(np.float32)
+
+
+class IsotonicStats(object):
+    """
+    Sufficient statistics of a weighted isotonic fit: sorted unique X (rounded to approximation
+    decimals) with the weighted sum of y and the total weight of every X. Memory is bounded by the
+    number of distinct X, not by the number of rows. Rows with zero weight are dropped.
+
+    Stats of different batches, processes or machines are merged by addition (associative and
+    commutative up to float64 rounding of the sums, exact for 0/1 labels and dyadic weights
+    such as 0.75/0.5), so finalising merged stats gives the same model as one fit on all rows.
+    """
+    def __init__(self, approximation: int = -1):
+        self.approximation = min(max(approximation, -1), 10)
+        self.x = np.array([], dtype=np.float32)
+        self.sum_y = np.array([], dtype=np.float64)
+        self.weight = np.array([], dtype=np.float64)
+
+    def __len__(self) -> int:
+        return len(self.x)
+
+    def _round(self, X: np.ndarray) -> np.ndarray:
+        if self.approximation > -1:
+            multiplier = np.float32(10**self.approximation)
+            X = np.round(X * multiplier) / multiplier
+        return X
+
+    @property
+    def means(self) -> np.ndarray:
+        return self.sum_y / self.weight
+
+    def update(self, X: np.ndarray, y: np.ndarray, sample_weight: Optional[np.ndarray] = None) -> 'IsotonicStats':
+        y = np.asarray(y, dtype=np.float64)
+        w = np.ones(len(y)) if sample_weight is None else np.asarray(sample_weight, dtype=np.float64).reshape(-1)
+        return self.update_aggregated(X, y * w, w)
+
+    def update_aggregated(self, X: np.ndarray, sum_y: np.ndarray, weight: np.ndarray) -> 'IsotonicStats':
+        """Pre-aggregated rows, e.g. (score, positives, total) tables; X does not have to be unique"""
+        X = self._round(np.asarray(X, dtype=np.float32).reshape(-1))
+        sum_y, weight = np.asarray(sum_y, dtype=np.float64), np.asarray(weight, dtype=np.float64)
+        keep = weight > 0
+        unique_X, idx = np.unique(X[keep], return_inverse=True)
+        self.x, self.sum_y, self.weight = _merge_sorted(
+            self.x, self.sum_y, self.weight, unique_X,
+            np.bincount(idx, weights=sum_y[keep], minlength=len(unique_X)),
+            np.bincount(idx, weights=weight[keep], minlength=len(unique_X))
+        )
+        return self
+
+    def merge(self, other: 'IsotonicStats') -> 'IsotonicStats':
+        assert self.approximation == other.approximation, 'Stats have different approximation'
+        self.x, self.sum_y, self.weight = _merge_sorted(
+            self.x, self.sum_y, self.weight, other.x, other.sum_y, other.weight
+        )
+        return self
+
+    def __add__(self, other: 'IsotonicStats') -> 'IsotonicStats':
+        return self.copy().merge(other)
+
+    def __radd__(self, other) -> 'IsotonicStats':
+        # sum() of a list of stats starts from 0
+        return self.copy() if isinstance(other, int) and other == 0 else self + other
+
+    def copy(self) -> 'IsotonicStats':
+        stats = IsotonicStats(self.approximation)
+        stats.x, stats.sum_y, stats.weight = self.x.copy(), self.sum_y.copy(), self.weight.copy()
+        return stats
+
+    def save(self, path: str) -> None:
+        np.savez(path, x=self.x, sum_y=self.sum_y, weight=self.weight, approximation=self.approximation)
+
+    @classmethod
+    def load(cls, path: str) -> 'IsotonicStats':
+        with np.load(path) as f:
+            stats = cls(int(f['approximation']))
+            stats.x, stats.sum_y, stats.weight = f['x'], f['sum_y'], f['weight']
+        return stats
+
+
+def _check_rank(x: np.ndarray) -> np.ndarray:
+    x = np.asarray(x, dtype=np.float32)
+    assert x.ndim == 1 or (x.ndim == 2 and x.shape[1] == 1), \
+        "Only 1d tensors or 2d tensors with one feature are supported."
+    return x.reshape(-1)
+
+
+class NPIsotonicRegression(object):
+    """
+    NumPy/numba implementation of tf_isotonic.TFIsotonicRegression with the same options and
+    fit/predict/save API, without TensorFlow. Fitted models convert both ways with
+    from_tf()/to_tf(). PAVA pools groups by their total (sample) weight.
+    """
+    def __init__(
+        self,
+        y_min: Optional[float] = None,
+        y_max: Optional[float] = None,
+        increasing: bool = True,
+        approximation: int = -1,
+    ):
+        self.y_min = y_min
+        self.y_max = y_max
+        self.increasing = increasing
+        self.approximation = min(max(approximation, -1), 10)
+        self.verbose = False
+
+    def partial_fit(self, x, y, sample_weight=None) -> 'NPIsotonicRegression':
+        """Adds a batch to stats_ without fitting, see finalize()"""
+        if not hasattr(self, 'stats_'):
+            self.stats_ = IsotonicStats(self.approximation)
+        self.stats_.update(_check_rank(x), _check_rank(y), None if sample_weight is None else _check_rank(sample_weight))
+        return self
+
+    def finalize(self) -> 'NPIsotonicRegression':
+        """Runs the monotone fit on the accumulated (possibly merged) stats_"""
+        assert self.stats_.approximation == self.approximation, 'Stats have different approximation'
+        self.X_thresholds_ = self.stats_.x.astype(np.float32)
+        self.y_thresholds_ = isotonic_y(
+            self.stats_.means, self.stats_.weight, self.increasing, self.y_min, self.y_max
+        )
+        self.X_min_, self.X_max_ = self.X_thresholds_[0], self.X_thresholds_[-1]
+        return self
+
+    def fit_stats(self, stats: IsotonicStats) -> 'NPIsotonicRegression':
+        """Fit from stats produced elsewhere, e.g. sum(IsotonicStats.load(p) for p in worker_paths)"""
+        self.stats_ = stats
+        return self.finalize()
+
+    def fit(
+            self,
+            x=None,
+            y=None,
+            batch_size=None,
+            verbose=False,
+            sample_weight=None,
+            **kwargs
+    ) -> 'NPIsotonicRegression':
+        """Other keras arguments are accepted for compatibility and do nothing"""
+        X, y = _check_rank(x), _check_rank(y)
+        w = np.ones(len(X), dtype=np.float32) if sample_weight is None else _check_rank(sample_weight)
+        batch_size = batch_size or max(len(X), 1)
+        return self.fit_batches(
+            ((X[i:i + batch_size], y[i:i + batch_size], w[i:i + batch_size]) for i in range(0, len(X), batch_size)),
+            verbose=verbose
+        )
+
+    def fit_batches(self, batches: Iterable[Tuple[np.ndarray, ...]], verbose=False) -> 'NPIsotonicRegression':
+        """Out-of-core fit over an iterable of (x, y) or (x, y, sample_weight) batches, e.g. read one file at a time"""
+        self.verbose = verbose
+        self.stats_ = IsotonicStats(self.approximation)
+        for i, (X, y, *w) in enumerate(batches):
+            self.partial_fit(X, y, w[0] if w else None)
+            if verbose:
+                print(f'\rBatch {i + 1}: {len(self.stats_)} distinct values', end='')
+        if verbose:
+            print()
+
+        return self.finalize()
+
+    def fit_aggregated(self, x, positives, total) -> 'NPIsotonicRegression':
+        """Fit from a (score, positives, total) table, e.g. a score histogram: y is positives / total with weight total"""
+        return self.fit_stats(IsotonicStats(self.approximation).update_aggregated(_check_rank(x), positives, total))
+
+    def predict(self, x, batch_size=None, verbose=False, **kwargs) -> np.ndarray:
+        return self(x)
+
+    def __call__(self, T) -> np.ndarray:
+        assert hasattr(self, 'X_thresholds_'), 'Model is not fitted'
+        T = np.clip(_check_rank(T), self.X_min_, self.X_max_)
+        x, y = self.X_thresholds_, self.y_thresholds_
+
+        if len(y) == 1:
+            return np.repeat(y, len(T))
+
+        below = np.clip(np.searchsorted(x, T, side='right') - 1, 0, len(x) - 2)
+        slope = (y[below + 1] - y[below]) / (x[below + 1] - x[below])
+        return (y[below] + slope * (T - x[below])).astype(np.float32)
+
+    @property
+    def params(self) -> dict:
+        return {
+            'y_min': self.y_min,
+            'y_max': self.y_max,
+            'increasing': self.increasing,
+            'approximation': self.approximation
+        }
+
+    def save(self, path: str) -> None:
+        assert hasattr(self, 'X_thresholds_'), 'Model is not fitted'
+        np.savez(path, params=np.array(json.dumps(self.params)), x=self.X_thresholds_, y=self.y_thresholds_)
+
+    @classmethod
+    def load(cls, path: str) -> 'NPIsotonicRegression':
+        with np.load(path, allow_pickle=False) as f:
+            model = cls(**json.loads(str(f['params'])))
+            model._set_knots(f['x'], f['y'])
+        return model
+
+    def _set_knots(self, x: np.ndarray, y: np.ndarray) -> None:
+        self.X_thresholds_ = np.asarray(x, dtype=np.float32)
+        self.y_thresholds_ = np.asarray(y, dtype=np.float32)
+        self.X_min_, self.X_max_ = self.X_thresholds_[0], self.X_thresholds_[-1]
+
+    @classmethod
+    def from_tf(cls, model) -> 'NPIsotonicRegression':
+        """
+        From a fitted tf_isotonic.TFIsotonicRegression, or one loaded with tf.keras.models.load_model:
+        its knots are saved, its options are not and take their defaults (the knots already apply them)
+        """
+        x, y = (np.asarray(t) for t in model.knots())
+        assert len(x) > 0, 'Model is not fitted'
+        np_model = cls(
+            getattr(model, 'y_min', None),
+            getattr(model, 'y_max', None),
+            getattr(model, 'increasing', True),
+            getattr(model, 'approximation', -1)
+        )
+        np_model._set_knots(x, y)
+        return np_model
+
+    def to_tf(self):
+        """To a fitted tf_isotonic.TFIsotonicRegression (imports TensorFlow)"""
+        import tensorflow as tf
+        from tf_isotonic import TFIsotonicRegression
+
+        model = TFIsotonicRegression(**self.params)
+        X, y = tf.constant(self.X_thresholds_), tf.constant(self.y_thresholds_)
+        model.X_min_, model.X_max_ = tf.reduce_min(X), tf.reduce_max(X)
+        model._build_f(X, y)
+        return model
+
+    def __repr__(self) -> str:
+        return (
+            f"NPIsotonicRegression(y_min={self.y_min}, y_max={self.y_max}, increasing={self.increasing}, "
+            f"approximation={self.approximation})"
+        )
@@ -1,7 +1,10 @@
 import os
+import numpy as np
 import tensorflow as tf
 
-from typing import Optional, Tuple
+from typing import Iterable, Optional, Tuple
+
+from np_isotonic import IsotonicStats, isotonic_y
 
 os.environ["TF_CPP_MIN_LOG_LEVEL"] = "1"
 tf.get_logger().setLevel("ERROR")
@@ -23,16 +26,10 @@ class TFIsotonicRegression(tf.keras.Model):
         self.increasing = increasing
         self.approximation = min(max(approximation, -1), 10)
         self.verbose = False
-        self.accumulated_X = tf.constant([], dtype=tf.float32)
-        self.accumulated_y = tf.constant([], dtype=tf.float32)
-
-    @staticmethod
-    @tf.function
-    def _to_matrix(x1: tf.Tensor, x2: tf.Tensor) -> tf.Tensor:
-        x1, x2 = [
-            tf.expand_dims(t, axis=-1) if len(t.shape) == 1 else t for t in [x1, x2]
-        ]
-        return tf.concat((x1, x2), axis=-1)
+        self.stats_ = IsotonicStats(self.approximation)
+        # interpolation knots as tracked variables, so a SavedModel keeps them (see knots())
+        self.x_knots = tf.Variable(tf.zeros([0]), shape=tf.TensorShape([None]), trainable=False, name="x_knots")
+        self.y_knots = tf.Variable(tf.zeros([0]), shape=tf.TensorShape([None]), trainable=False, name="y_knots")
 
     @staticmethod
     @tf.function
@@ -47,28 +44,6 @@ class TFIsotonicRegression(tf.keras.Model):
         except ValueError:
             return x
 
-    @staticmethod
-    @tf.function
-    def _in1d(arr1: tf.Tensor, arr2: tf.Tensor) -> tf.Tensor:
-        """Returns boolean as tf.Tensor"""
-        arr1 = tf.expand_dims(arr1, 1)
-        arr2 = tf.expand_dims(arr2, 0)
-        return tf.reduce_any(tf.reduce_any(tf.equal(arr1, arr2), axis=1))
-
-    @tf.function
-    def _tf_groupby(self, x1: tf.Tensor, x2: tf.Tensor) -> Tuple[tf.Tensor, tf.Tensor]:
-        tensor = self._to_matrix(x1, x2)
-        sorted_indices = tf.argsort(tensor[:, 0])
-        sorted_tensor = tf.gather(tensor, sorted_indices)
-
-        unique_keys, idx, counts = tf.unique_with_counts(sorted_tensor[:, 0])
-        sum_values = tf.math.unsorted_segment_sum(
-            sorted_tensor[:, 1], idx, tf.shape(unique_keys)[0]
-        )
-        aggregated_values = sum_values / tf.cast(counts, tf.float32)
-
-        return unique_keys, aggregated_values
-
     @staticmethod
     @tf.function
     def _linear_interp1d(x: tf.Tensor, y: tf.Tensor, new_x: tf.Tensor) -> tf.Tensor:
@@ -86,7 +61,22 @@ class TFIsotonicRegression(tf.keras.Model):
 
         return interpolated_y
 
+    @tf.function(input_signature=[])
+    def knots(self) -> Tuple[tf.Tensor, tf.Tensor]:
+        """Interpolation knots (x, y), also of a model loaded with tf.keras.models.load_model"""
+        return self.x_knots.read_value(), self.y_knots.read_value()
+
+    @property
+    def X_thresholds_(self) -> tf.Tensor:
+        return self.x_knots.read_value()
+
+    @property
+    def y_thresholds_(self) -> tf.Tensor:
+        return self.y_knots.read_value()
+
     def _build_f(self, X: tf.Tensor, y: tf.Tensor) -> None:
+        self.x_knots.assign(X)
+        self.y_knots.assign(y)
         if len(y) == 1:
             self.f_ = lambda x: tf.repeat(y, len(X))
         else:
@@ -94,52 +84,85 @@ class TFIsotonicRegression(tf.keras.Model):
 
     @tf.function
     def _build_y(
-        self, X: tf.Tensor, y: tf.Tensor
+        self, X: tf.Tensor, y: tf.Tensor, w: tf.Tensor
     ) -> Tuple[tf.Tensor, tf.Tensor, tf.Tensor, tf.Tensor]:
-        iso_y = tf.clip_by_value(
-            tf.nn.isotonic_regression(y, decreasing=not self.increasing)[0],
-            self.y_min,
-            self.y_max,
+        # tf.nn.isotonic_regression has no weights, groups are pooled by weight with the numba PAVA
+        iso_y = tf.numpy_function(
+            lambda y, w: isotonic_y(y, w, self.increasing, self.y_min, self.y_max),
+            [y, w],
+            tf.float32,
         )
+        iso_y = tf.reshape(iso_y, tf.shape(y))
 
         X_min_, X_max_ = tf.reduce_min(X), tf.reduce_max(X)
         return X, iso_y, X_min_, X_max_
 
-    @tf.function
-    def _fit(self, X: tf.Tensor, y: tf.Tensor) -> None:
-        unique_X, unique_y = self._tf_groupby(X, y)
-        X_iso, y_iso, self.X_min_, self.X_max_ = self._build_y(unique_X, unique_y)
+    def _fit_batch(
+        self, X: tf.Tensor, y: tf.Tensor, build_final: bool, w: Optional[tf.Tensor] = None
+    ) -> None:
+        # only (sum w * y, sum w) per distinct X is kept, merged into the sorted stats; PAVA runs once
+        self.stats_.update(np.asarray(X), np.asarray(y), None if w is None else np.asarray(w))
+
+        if build_final:
+            self.finalize()
+
+    def finalize(self) -> tf.keras.Model:
+        """Runs the monotone fit on the accumulated (possibly merged) stats_"""
+        assert self.stats_.approximation == self.approximation, "Stats have different approximation"
+        X_iso, y_iso, self.X_min_, self.X_max_ = self._build_y(
+            tf.constant(self.stats_.x),
+            # float64 as in the stats: float32 totals per X lose precision past 2**24 rows
+            tf.constant(self.stats_.means, dtype=tf.float64),
+            tf.constant(self.stats_.weight, dtype=tf.float64),
+        )
         self._build_f(X_iso, y_iso)
+        return self
 
-    def _fit_batch(self, X: tf.Tensor, y: tf.Tensor, build_final: bool) -> None:
-        combined_X = tf.concat([self.accumulated_X, X], axis=0)
-        combined_y = tf.concat([self.accumulated_y, y], axis=0)
+    def partial_fit(self, x, y, sample_weight=None) -> tf.keras.Model:
+        """Adds a batch to stats_ without fitting, see finalize()"""
+        self.stats_.update(
+            np.asarray(self._check_rank(tf.convert_to_tensor(x, dtype=tf.float32))),
+            np.asarray(self._check_rank(tf.convert_to_tensor(y, dtype=tf.float32))),
+            None if sample_weight is None else np.asarray(sample_weight, dtype=np.float32).reshape(-1),
+        )
+        return self
 
-        if self._in1d(self.accumulated_X, X) and not build_final:
-            self.accumulated_X, self.accumulated_y = self._tf_groupby(
-                combined_X, combined_y
-            )
+    def fit_stats(self, stats: IsotonicStats) -> tf.keras.Model:
+        """Fit from stats produced elsewhere, e.g. sum(IsotonicStats.load(p) for p in worker_paths)"""
+        self.stats_ = stats
+        return self.finalize()
 
-        if build_final:
-            self.accumulated_X, self.accumulated_y = self._tf_groupby(
-                combined_X, combined_y
-            )
-            X_iso, y_iso, self.X_min_, self.X_max_ = self._build_y(
-                self.accumulated_X, self.accumulated_y
-            )
-            self._build_f(X_iso, y_iso)
+    def _fit_batchwise(
+        self, X: tf.Tensor, y: tf.Tensor, w: tf.Tensor, batch_size: int
+    ) -> None:
+        num_batches = -(-len(X) // batch_size)
+        dataset = tf.data.Dataset.from_tensor_slices((X, y, w)).batch(batch_size)
+        self.stats_ = IsotonicStats(self.approximation)
 
-    def _fit_batchwise(self, X: tf.Tensor, y: tf.Tensor, batch_size: int) -> None:
-        num_batches = len(X) // batch_size
-        dataset = tf.data.Dataset.from_tensor_slices((X, y)).batch(batch_size)
+        for i, (batch_X, batch_y, batch_w) in enumerate(dataset):
+            self._fit_batch(batch_X, batch_y, build_final=i == num_batches - 1, w=batch_w)
+            self._print_progressbar(i, num_batches)
 
-        for i, (batch_X, batch_y) in enumerate(dataset):
-            if i >= num_batches - 1:
-                self._fit_batch(batch_X, batch_y, build_final=True)
-            else:
-                self._fit_batch(batch_X, batch_y, build_final=False)
+    def _round(self, X: tf.Tensor) -> tf.Tensor:
+        if self.approximation > -1:
+            multiplier = tf.constant(10**self.approximation, dtype=X.dtype)
+            X = tf.round(X * multiplier) / multiplier
+        return X
 
-            self._print_progressbar(i, num_batches)
+    def fit_batches(self, batches: Iterable[Tuple[np.ndarray, ...]], verbose=False) -> tf.keras.Model:
+        """Out-of-core fit over an iterable of (x, y) or (x, y, sample_weight) batches, e.g. read one file at a time"""
+        self.verbose = verbose
+        self.stats_ = IsotonicStats(self.approximation)
+
+        for batch_X, batch_y, *batch_w in batches:
+            self.partial_fit(batch_X, batch_y, batch_w[0] if batch_w else None)
+
+        return self.finalize()
+
+    def fit_aggregated(self, x, positives, total) -> tf.keras.Model:
+        """Fit from a (score, positives, total) table, e.g. a score histogram: y is positives / total with weight total"""
+        X = self._check_rank(tf.convert_to_tensor(x, dtype=tf.float32))
+        return self.fit_stats(IsotonicStats(self.approximation).update_aggregated(np.asarray(X), positives, total))
 
     def _print_progressbar(self, i: int, max_value: int) -> None:
         if self.verbose:
@@ -178,21 +201,25 @@ class TFIsotonicRegression(tf.keras.Model):
         use_multiprocessing=False,
     ) -> tf.keras.Model:
         """
-        Parameters except x, y, batch_size and verbose do nothing and serve only the compatibility purpose
+        Parameters except x, y, batch_size, verbose and sample_weight do nothing and serve only the compatibility purpose.
+        Groups of equal x are pooled in PAVA by their total sample weight (row count if sample_weight is None)
         """
         self.verbose = verbose
 
         X = self._check_rank(tf.convert_to_tensor(x, dtype=tf.float32))
         y = self._check_rank(tf.convert_to_tensor(y, dtype=tf.float32))
+        w = tf.ones_like(y) if sample_weight is None else \
+            self._check_rank(tf.convert_to_tensor(sample_weight, dtype=tf.float32))
 
-        if self.approximation > -1:
-            multiplier = tf.constant(10**self.approximation, dtype=X.dtype)
-            X = tf.round(X * multiplier) / multiplier
+        X = self._round(X)
+        X, y, w = [tf.boolean_mask(t, w > 0) for t in (X, y, w)]
 
         if batch_size is None:
-            self._fit(X, y)
+            # same float64 stats as the batched, fit_batches and fit_stats paths
+            self.stats_ = IsotonicStats(self.approximation)
+            self._fit_batch(X, y, build_final=True, w=w)
         else:
-            self._fit_batchwise(X, y, batch_size)
+            self._fit_batchwise(X, y, w, batch_size)
 
         return self
 